@@ -0,0 +1,82 @@
+import json
+import os
+import threading
+import zipfile
+from collections import OrderedDict, defaultdict
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import hierarchy
+
+if TYPE_CHECKING:
+  from azure.cognitiveservices.vision.computervision.models import ImageAnalysis
+
+
+# serves analyses straight out of an archive of Azure json responses laid out as
+#   json-analyze/<frame directory>/<frame name>.json
+# (see test_json_zip_loading), so the book can be regenerated without secrets.py, the rate limiter or even the frames.
+# the index comes from the zip's central directory, members are only read + deserialized when asked for, and the most
+# recently used analyses are kept around.
+# the object hierarchy the reducer needs comes from the archive too (see hierarchy()), not from the local .cache
+class ZipAnalysisProvider:
+  def __init__(self, zip_path: str, cache_size: int = 2048):
+    self.zip_path = zip_path
+    self.cache_size = cache_size
+    self._zip = zipfile.ZipFile(zip_path, 'r')
+    self._lock = threading.Lock()
+    self._cache: 'OrderedDict[Tuple[str, str], ImageAnalysis]' = OrderedDict()
+    self._index: Dict[Tuple[str, str], zipfile.ZipInfo] = {}
+    self._frames: Dict[str, List[str]] = defaultdict(list)
+    self._hierarchy: Optional[hierarchy.Hierarchy] = None
+    for info in self._zip.infolist():
+      parts = info.filename.split('/')
+      if info.is_dir() or len(parts) < 2 or not parts[-1].endswith('.json'):
+        continue
+      frame = os.path.splitext(parts[-1])[0]
+      self._index[(parts[-2], frame)] = info
+      self._frames[parts[-2]].append(frame)
+
+  @staticmethod
+  def _key(filename: str) -> Tuple[str, str]:
+    filename = filename.replace('\\', '/')
+    return os.path.basename(os.path.dirname(filename)), os.path.splitext(os.path.basename(filename))[0]
+
+  def __contains__(self, filename: str) -> bool:
+    return self._key(filename) in self._index
+
+  # the frames of a directory, named like the .png files they were made from (which don't need to exist)
+  def frames(self, directory: str) -> List[str]:
+    name = os.path.basename(directory.replace('\\', '/'))
+    return sorted(directory + '/' + frame + '.png' for frame in self._frames.get(name, []))
+
+  def get(self, filename: str) -> Optional['ImageAnalysis']:
+    key = self._key(filename)
+    with self._lock:
+      if key in self._cache:
+        self._cache.move_to_end(key)
+        return self._cache[key]
+      info = self._index.get(key)
+      if info is None:
+        return None
+      data = self._zip.read(info)
+    from azure.cognitiveservices.vision.computervision.models import ImageAnalysis
+    analysis = ImageAnalysis.deserialize(json.loads(data))
+    with self._lock:
+      self._cache[key] = analysis
+      if len(self._cache) > self.cache_size:
+        self._cache.popitem(last=False)
+    return analysis
+
+  # learned from every analysis in the archive, like a build learns it from every analysis in its store, so a replay
+  # drops the same generic terms as the build that made the archive, even on a machine without a .cache
+  def hierarchy(self) -> hierarchy.Hierarchy:
+    with self._lock:
+      if self._hierarchy is None:
+        from azure.cognitiveservices.vision.computervision.models import ImageAnalysis
+        h = hierarchy.Hierarchy(None)
+        for info in self._index.values():
+          h.add_analysis(ImageAnalysis.deserialize(json.loads(self._zip.read(info))))
+        self._hierarchy = h
+      return self._hierarchy
+
+  def close(self):
+    self._zip.close()
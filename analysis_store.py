@@ -0,0 +1,136 @@
+import glob
+import mmap
+import os
+import pickle
+import struct
+import threading
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from loguru import logger
+
+# a packed, append-only replacement for one .cache/<sha256>.pkl file per frame:
+#   <prefix>.pack - the pickles, back to back
+#   <prefix>.idx  - fixed size (sha256 digest, offset, length) records, appended after the pickle is written
+# the index is read into a dict once, so membership checks never touch the filesystem, and reads go through an mmap.
+# a crash between the two appends leaves an unindexed tail in the pack, which only wastes a little space,
+# and a torn index record is dropped on load, as are records past the end of the pack (the index reached the disk
+# but the pickle didn't).
+
+_record = struct.Struct('<32sQQ')
+
+
+class AnalysisStore:
+  def __init__(self, prefix: str):
+    self.pack_file = prefix + '.pack'
+    self.index_file = prefix + '.idx'
+    directory = os.path.dirname(self.pack_file)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    self._lock = threading.Lock()
+    self._index: Dict[str, Tuple[int, int]] = {}
+    self._map: Optional[mmap.mmap] = None
+    self._load_index()
+    self._pack = open(self.pack_file, 'ab')
+    self._index_out = open(self.index_file, 'ab')
+
+  def _load_index(self):
+    pack_size = os.path.getsize(self.pack_file) if os.path.isfile(self.pack_file) else 0
+    if not os.path.isfile(self.index_file):
+      return
+    with open(self.index_file, 'rb') as source:
+      data = source.read()
+    usable = len(data) - len(data) % _record.size
+    if usable != len(data):
+      logger.warning('{}: ignoring {} bytes of a partially written record', self.index_file, len(data) - usable)
+    good = 0
+    for digest, offset, length in _record.iter_unpack(data[:usable]):
+      if offset + length > pack_size:
+        # offsets only grow, so every record from here on is past the end of the pack
+        logger.warning('{}: ignoring {} records past the end of {}', self.index_file,
+                       (usable - good) // _record.size, self.pack_file)
+        break
+      self._index[digest.hex()] = (offset, length)
+      good += _record.size
+    if good != len(data):
+      with open(self.index_file, 'r+b') as truncate:
+        truncate.truncate(good)
+
+  def __len__(self) -> int:
+    return len(self._index)
+
+  def __contains__(self, file_hash: str) -> bool:
+    return file_hash in self._index
+
+  def _view(self, end: int) -> mmap.mmap:
+    # the pack only grows, so the map is only re-created when asked for something past its end
+    if self._map is None or len(self._map) < end:
+      if self._map is not None:
+        self._map.close()
+      with open(self.pack_file, 'rb') as source:
+        self._map = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    return self._map
+
+  def get(self, file_hash: str) -> Optional[Any]:
+    with self._lock:
+      if file_hash not in self._index:
+        return None
+      offset, length = self._index[file_hash]
+      return pickle.loads(self._view(offset + length)[offset:offset + length])
+
+  def get_many(self, file_hashes: Iterable[str]) -> Dict[str, Any]:
+    # one forward pass over the pack in offset order, e.g. for all the frames of a chapter
+    with self._lock:
+      wanted = sorted(set(h for h in file_hashes if h in self._index), key=lambda h: self._index[h])
+      if not wanted:
+        return {}
+      view = self._view(sum(self._index[wanted[-1]]))
+      ret = {}
+      for h in wanted:
+        offset, length = self._index[h]
+        ret[h] = pickle.loads(view[offset:offset + length])
+      return ret
+
+  def items(self) -> Iterator[Tuple[str, Any]]:
+    # every (file hash, analysis), in the order they were added
+    with self._lock:
+      entries = sorted(self._index.items(), key=lambda kv: kv[1])
+    for h, (offset, length) in entries:
+      with self._lock:
+        value = pickle.loads(self._view(offset + length)[offset:offset + length])
+      yield h, value
+
+  def put(self, file_hash: str, value: Any):
+    self.put_raw(file_hash, pickle.dumps(value))
+
+  def put_raw(self, file_hash: str, data: bytes):
+    with self._lock:
+      if file_hash in self._index:
+        return
+      self._pack.seek(0, os.SEEK_END)
+      offset = self._pack.tell()
+      self._pack.write(data)
+      self._pack.flush()
+      self._index_out.write(_record.pack(bytes.fromhex(file_hash), offset, len(data)))
+      self._index_out.flush()
+      self._index[file_hash] = (offset, len(data))
+
+  def migrate_pickles(self, directory: str) -> int:
+    # one-time import of the old .cache/<sha256>.pkl files, the pickled bytes are copied as-is
+    added = 0
+    for pkl in sorted(glob.glob(os.path.join(directory, '*.pkl'))):
+      file_hash = os.path.splitext(os.path.basename(pkl))[0]
+      if len(file_hash) != 64 or file_hash in self._index:
+        continue
+      with open(pkl, 'rb') as source:
+        self.put_raw(file_hash, source.read())
+      added += 1
+    logger.info('migrated {} pickles from {} into {}', added, directory, self.pack_file)
+    return added
+
+  def close(self):
+    with self._lock:
+      if self._map is not None:
+        self._map.close()
+        self._map = None
+      self._pack.close()
+      self._index_out.close()
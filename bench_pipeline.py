@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+import cloud_vision
+import hierarchy
+import textmods
+
+# offline micro-benchmarks for the text pipeline's hot paths, no Azure credentials or network needed:
+#   python bench_pipeline.py                   # run everything and compare with bench_baseline.json
+#   python bench_pipeline.py --save-baseline   # record the current numbers as the new baseline
+#   python bench_pipeline.py -k reducer        # only the benchmarks with 'reducer' in their name
+# recorded analyses are read from json-analyze.zip (json-analyze/<dir>/<frame>.json, see test_json_zip_loading),
+# and synthetic analyses are used when it isn't there
+
+baseline_file = 'bench_baseline.json'
+fixture_zip = 'json-analyze.zip'
+
+# a benchmark is slower than its baseline when it does fewer than (1 - tolerance) of the baseline's ops/sec
+tolerance = 0.2
+
+_captions = ['a man standing in front of a building', 'a group of people on a stage', 'a woman dancing in a room',
+             'a dog in the night sky', 'a person playing an electric guitar', 'a black background with white text',
+             'a cloudy sky full of clouds', 'a car driving down a road']
+_terms = ['man', 'woman', 'person', 'people', 'dog', 'dogs', 'sky', 'night sky', 'night', 'darkness', 'cloud',
+          'clouds', 'cloudy', 'building', 'stage', 'dancing', 'dance', 'guitar', 'electric guitar', 'string instrument',
+          'musical instrument', 'text', 'font', 'car', 'street', 'indoor', 'outdoor', 'clothing',
+          'standing', 'smile', 'concert', 'music', 'performance', 'light', 'black', 'white', 'screenshot', 'tree']
+_hierarchy_edges = [('electric guitar', 'guitar'), ('guitar', 'string instrument'),
+                    ('string instrument', 'musical instrument'), ('dog', 'animal'), ('car', 'land vehicle'),
+                    ('land vehicle', 'vehicle')]
+
+
+def synthetic_phrases(size: int, rng: random.Random) -> List[str]:
+  phrases = [rng.choice(_captions)]
+  phrases += rng.sample(_terms, min(size - 1, len(_terms)))
+  while len(phrases) < size:
+    phrases.append(rng.choice(_terms) + ' ' + rng.choice(_terms))
+  return phrases
+
+
+def synthetic_analysis(rng: random.Random) -> SimpleNamespace:
+  n = SimpleNamespace
+  return n(description=n(captions=[n(text=rng.choice(_captions), confidence=0.5)], tags=rng.sample(_terms, 8)),
+           categories=[], tags=[n(name=t, confidence=0.9) for t in rng.sample(_terms, 12)],
+           objects=[n(object_property=t, parent=None, confidence=0.7) for t in rng.sample(_terms, 3)], faces=[])
+
+
+def load_analyses(limit: int = 200) -> list:
+  if not os.path.isfile(fixture_zip):
+    rng = random.Random(0)
+    return [synthetic_analysis(rng) for _ in range(limit)]
+  from azure.cognitiveservices.vision.computervision.models import ImageAnalysis
+  with zipfile.ZipFile(fixture_zip, 'r') as zf:
+    names = sorted(n for n in zf.namelist() if n.endswith('.json'))[:limit]
+    return [ImageAnalysis.deserialize(json.load(zf.open(n))) for n in names]
+
+
+def use_synthetic_hierarchy():
+  # benchmarks shouldn't depend on (or build) the real .cache/hierarchy.jsonl
+  journal = os.path.join(tempfile.mkdtemp(), 'hierarchy.jsonl')
+  with open(journal, 'wt') as out:
+    for edge in _hierarchy_edges:
+      out.write(json.dumps(edge) + '\n')
+  cloud_vision._hierarchy = hierarchy.Hierarchy(journal)
+
+
+def get_benchmarks() -> Dict[str, Callable[[], object]]:
+  rng = random.Random(2021)
+  use_synthetic_hierarchy()
+  analyses = load_analyses()
+  benchmarks = {}
+  for size in [10, 30, 100]:
+    phrases = synthetic_phrases(size, rng)
+    benchmarks['reducer/%d' % size] = lambda p=phrases: cloud_vision._reducer(p)
+    benchmarks['is_overlap/%d' % size] = lambda p=phrases: [cloud_vision.is_overlap(p, k) for k in p]
+    chapter = [synthetic_phrases(size, rng) for _ in range(50)]
+    benchmarks['reduce_many/50x%d' % size] = lambda c=chapter: cloud_vision.reduce_many(c)
+
+  benchmarks['extract_text/%d' % len(analyses)] = lambda: [cloud_vision.extract_text(d) for d in analyses]
+  benchmarks['get_generic_terms_for/%d' % len(_terms)] = lambda: [cloud_vision.get_generic_terms_for(t) for t in _terms]
+
+  keeps = [([p[0].upper() + p[1:] for p in synthetic_phrases(12, rng)], []) for _ in range(1000)]
+  benchmarks['window/1000'] = lambda: cloud_vision.apply_window('bench', keeps, 4, False)
+  benchmarks['window_randomized/1000'] = lambda: cloud_vision.apply_window('bench', keeps, 4, True, rng=random.Random(1))
+
+  lines = [[k + '.' for k in keep] for keep, _ in keeps[:200]]
+  benchmarks['do_anything_many/200'] = lambda: textmods.do_anything_many(lines, random.Random(1))
+  return benchmarks
+
+
+def measure(func: Callable[[], object], min_time: float = 0.3) -> dict:
+  func()  # warm-up
+  runs = 0
+  start = time.perf_counter()
+  elapsed = 0.0
+  while elapsed < min_time:
+    func()
+    runs += 1
+    elapsed = time.perf_counter() - start
+
+  tracemalloc.start()
+  before = tracemalloc.take_snapshot()
+  tracemalloc.reset_peak()
+  start_size, _ = tracemalloc.get_traced_memory()
+  result = func()
+  _, peak = tracemalloc.get_traced_memory()
+  peak -= start_size
+  after = tracemalloc.take_snapshot()
+  tracemalloc.stop()
+  del result
+  # the blocks one call allocated and still has at its end (the result is kept alive for the snapshot, so that
+  # includes what it returns, and caches it fills), and the peak memory during it, which includes its temporaries.
+  # the first snapshot is itself allocated while tracing, so tracemalloc's own blocks don't count
+  ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+  new = [s for s in after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'traceback')
+         if s.count_diff > 0]
+  return {'ops_per_sec': round(runs / elapsed, 2), 'allocations': sum(s.count_diff for s in new),
+          'allocated_kb': round(sum(max(s.size_diff, 0) for s in new) / 1024, 1), 'peak_kb': round(peak / 1024, 1)}
+
+
+def run(keyword: str = '', min_time: float = 0.3) -> Dict[str, dict]:
+  results = {}
+  for name, func in get_benchmarks().items():
+    if keyword in name:
+      results[name] = measure(func, min_time)
+  return results
+
+
+def report(results: Dict[str, dict], baseline: Dict[str, dict]) -> List[str]:
+  regressions = []
+  print('%-28s %12s %10s %12s %10s %10s' % ('benchmark', 'ops/sec', 'baseline', 'allocations', 'alloc KiB',
+                                            'peak KiB'))
+  for name, r in results.items():
+    base = baseline.get(name, {}).get('ops_per_sec')
+    flag = ''
+    if base and r['ops_per_sec'] < base * (1 - tolerance):
+      flag = '  <-- slower'
+      regressions.append(name)
+    print('%-28s %12.1f %10s %12d %10.1f %10.1f%s' % (name, r['ops_per_sec'], '%.1f' % base if base else '-',
+                                                      r['allocations'], r['allocated_kb'], r['peak_kb'], flag))
+  return regressions
+
+
+if __name__ == "__main__":
+  a = argparse.ArgumentParser()
+  a.add_argument('-k', dest='keyword', default='', help='only run benchmarks containing this')
+  a.add_argument('--min-time', default=0.3, type=float, help='seconds per benchmark')
+  a.add_argument('--save-baseline', action='store_true')
+  args = a.parse_args()
+  current = run(args.keyword, args.min_time)
+  try:
+    previous = json.load(open(baseline_file, 'r'))
+  except (IOError, ValueError):
+    previous = {}
+  slower = report(current, previous)
+  if args.save_baseline:
+    previous.update(current)
+    with open(baseline_file, 'wt') as out:
+      json.dump(previous, out, indent=2, sort_keys=True)
+    print('saved', baseline_file)
+  elif slower:
+    raise SystemExit('slower than baseline: ' + ', '.join(slower))
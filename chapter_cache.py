@@ -0,0 +1,54 @@
+import hashlib
+import json
+import os
+from typing import List, Optional, Tuple
+
+# generated chapters, remembered by a key made of everything that goes into them (the frames' hashes in order, the
+# window, the rng state, the text rules, ...). the lines themselves stay in the chapter's .debug-parts file, a summary
+# json per key has what else the chapter contributes to the book (its phrases for the corpus, celebrities, the rng
+# state afterwards) and the hash of the .debug-parts file it belongs to, so a part that was overwritten since (e.g. by
+# a run with other settings) is a miss instead of the wrong chapter.
+
+
+def chapter_key(parts: dict) -> str:
+  return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _part_hash(text: str) -> str:
+  return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ChapterCache:
+  def __init__(self, directory: str):
+    self.directory = directory
+
+  def _summary_file(self, key: str) -> str:
+    return os.path.join(self.directory, key + '.json')
+
+  def get(self, key: str, part_file: str) -> Optional[Tuple[List[str], dict]]:
+    # (the chapter's lines, its summary)
+    try:
+      with open(self._summary_file(key), 'rt', encoding='utf-8') as f:
+        summary = json.load(f)
+      with open(part_file, 'rt', encoding='utf-8') as f:
+        text = f.read()
+    except (OSError, ValueError):
+      return None
+    if _part_hash(text) != summary['part']:
+      return None
+    # the part is every line followed by a blank line, see write_through
+    lines = text[:-2].split('\n\n') if text else []
+    if len(lines) != summary['lines']:
+      return None
+    return lines, summary
+
+  def put(self, key: str, part_file: str, line_count: int, summary: dict):
+    # line_count is the number of lines written, a line with a blank line in it can't be read back
+    with open(part_file, 'rt', encoding='utf-8') as f:
+      text = f.read()
+    summary = dict(summary, part=_part_hash(text), lines=line_count)
+    os.makedirs(self.directory, exist_ok=True)
+    tmp = self._summary_file(key) + '.tmp'
+    with open(tmp, 'wt', encoding='utf-8') as out:
+      json.dump(summary, out)
+    os.replace(tmp, self._summary_file(key))
@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import shutil
+from typing import Dict, List, Optional
+
+# what Azure classifies as adult, racy and gory, for every analyzed frame: hash, path, the three flags and their scores,
+# one json object per line (the last line for a path wins). frames used to be copied into .debug-class/<flag>/ on
+# every run, now they are only recorded here, and links are made for newly flagged frames if asked for:
+#   python classification_index.py racy --chapter bad-apple
+
+flags = ('adult', 'racy', 'gory')
+# 'hardlink', 'symlink', 'copy' or None (the index only)
+link_modes = ('hardlink', 'symlink', 'copy', None)
+
+
+def record_for(path: str, file_hash: Optional[str], adult) -> dict:
+  # adult is the analysis' AdultInfo
+  return {'hash': file_hash, 'path': path.replace('\\', '/'),
+          'chapter': os.path.basename(os.path.dirname(path.replace('\\', '/'))),
+          'adult': bool(adult.is_adult_content), 'racy': bool(adult.is_racy_content),
+          'gory': bool(adult.is_gory_content), 'adult_score': adult.adult_score, 'racy_score': adult.racy_score,
+          'gory_score': adult.gore_score}
+
+
+class ClassificationIndex:
+  def __init__(self, journal_file: str, links: Optional[str] = 'hardlink'):
+    assert links in link_modes, (links, link_modes)
+    self.journal_file = journal_file
+    self.links = links
+    self.records: Dict[str, dict] = {}
+    if os.path.isfile(journal_file):
+      with open(journal_file, 'rt', encoding='utf-8') as source:
+        for line in source:
+          try:
+            r = json.loads(line)
+          except ValueError:
+            continue  # torn last line from a crash
+          self.records[r['path']] = r
+
+  def __len__(self):
+    return len(self.records)
+
+  def known_hash(self, path: str) -> Optional[str]:
+    record = self.records.get(path.replace('\\', '/'))
+    return record['hash'] if record else None
+
+  def add(self, record: dict) -> bool:
+    # returns whether this is new (or changed) for the path. lines are appended with a single write, so several
+    # chapter processes can share the journal
+    if self.records.get(record['path']) == record:
+      return False
+    self.records[record['path']] = record
+    with open(self.journal_file, 'at', encoding='utf-8') as out:
+      out.write(json.dumps(record) + '\n')
+    for flag in flags:
+      if record[flag]:
+        self.materialize(record['path'], os.path.join(os.path.dirname(self.journal_file), flag))
+    return True
+
+  def materialize(self, path: str, directory: str):
+    if self.links is None or not os.path.isfile(path):
+      return  # replaying from an archive without the frames
+    target = os.path.join(directory, os.path.basename(path))
+    if os.path.lexists(target):
+      return
+    os.makedirs(directory, exist_ok=True)
+    if self.links == 'symlink':
+      os.symlink(os.path.abspath(path), target)
+      return
+    if self.links == 'hardlink':
+      try:
+        os.link(path, target)
+        return
+      except OSError:
+        pass  # another file system, or no hardlinks there
+    shutil.copy(path, target)
+
+  def frames(self, flag: Optional[str] = None, chapter: Optional[str] = None) -> List[dict]:
+    assert flag is None or flag in flags, (flag, flags)
+    return [r for r in self.records.values()
+            if (flag is None or r[flag]) and (chapter is None or r['chapter'] == chapter)]
+
+
+if __name__ == "__main__":
+  a = argparse.ArgumentParser()
+  a.add_argument('flag', nargs='?', choices=flags)
+  a.add_argument('--chapter', help='frame directory name, e.g. bad-apple')
+  a.add_argument('--index', default='.debug-class/classification.jsonl')
+  args = a.parse_args()
+  for r in ClassificationIndex(args.index, links=None).frames(args.flag, args.chapter):
+    print('%s  adult=%.3f racy=%.3f gory=%.3f' % (r['path'], r['adult_score'], r['racy_score'], r['gory_score']))
@@ -1,83 +1,142 @@
-import atexit
+from __future__ import annotations
+
+import datetime
 import glob
 import hashlib
+import io
 import itertools
-import json
+import multiprocessing
 import os
-import pickle
-import shutil
+import random
 import subprocess
-from collections import Counter
-from typing import Iterable, Optional, List, Tuple
-
-import jsonpickle
-import pandas as pd
-from azure.cognitiveservices.vision.computervision import ComputerVisionClient
-from azure.cognitiveservices.vision.computervision.models import ImageAnalysis
-from azure.cognitiveservices.vision.computervision.models import VisualFeatureTypes
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, Optional, List, Set, Tuple
+
 from loguru import logger
-from msrest.authentication import CognitiveServicesCredentials
-from tqdm.auto import tqdm
 
 import time
 
-from ratelimiter import RateLimiter
-
-import secrets
+import analysis_providers
+import analysis_store
+import chapter_cache
+import classification_index
+import debug_sink
+import file_hashes
+import frame_dedup
+import hierarchy
+import job_queue
+import metrics
+import pandoc_fragments
+import phrase_records
 import textmods
+import upload_payload
+import vision_pipeline
+
+# pandas, the Azure SDK, tqdm, jsonpickle, cv2 and numpy are only imported when they're first needed, and the caches and
+# directories are set up on first use, so importing this for the text functions (the reducer, the window) is quick
+# (see test_import_time)
+if TYPE_CHECKING:
+  from azure.cognitiveservices.vision.computervision import ComputerVisionClient
+  from azure.cognitiveservices.vision.computervision.models import ImageAnalysis
+  import phrase_vocab
 
-'''
-Authenticate
-Authenticates your credentials and creates a client.
-'''
-subscription_key = secrets.VISION_KEY
 endpoint = "https://genmo2021.cognitiveservices.azure.com/"
-# not all of these are used but it's the free tier and it makes caching easier to have everything there
-all_visual_features = [eval('VisualFeatureTypes.' + x) for x in dir(VisualFeatureTypes) if "__" not in x]
 
-# noinspection PyTypeChecker
-computervision_client = ComputerVisionClient(endpoint, CognitiveServicesCredentials(subscription_key))
+computervision_client: Optional[ComputerVisionClient] = None
+_visual_features = None
 
 
-def persist_to_file(file_name):
-  try:
-    cache = json.load(open(file_name, 'r'))
-  except (IOError, ValueError):
-    cache = {}
+# not all of these are used but it's the free tier and it makes caching easier to have everything there
+def get_visual_features() -> list:
+  global _visual_features
+  if _visual_features is None:
+    from azure.cognitiveservices.vision.computervision.models import VisualFeatureTypes
+    _visual_features = [getattr(VisualFeatureTypes, x) for x in dir(VisualFeatureTypes) if "__" not in x]
+  return _visual_features
+
+
+'''
+Authenticate
+Authenticates your credentials and creates a client, on first use so that cached/offline runs don't need secrets.py
+'''
+def get_client() -> ComputerVisionClient:
+  if computervision_client is None:
+    import secrets
+    connect(endpoint, secrets.VISION_KEY)
+  return computervision_client
 
-  atexit.register(lambda: json.dump(cache, open(file_name, 'w'), indent=2))
 
-  def decorator(func):
-    def new_func(param):
-      assert isinstance(param, str), ('only strings supported due to json round-tripping, got:', type(param), param)
-      if param not in cache:
-        cache[param] = func(param)
-      return cache[param]
+# e.g. connect(stand_in_vision.endpoint_for(stand_in_vision.serve()), 'unused') to run against a local stand-in
+def connect(url: str, key: str):
+  global computervision_client
+  from azure.cognitiveservices.vision.computervision import ComputerVisionClient
+  from msrest.authentication import CognitiveServicesCredentials
+  # noinspection PyTypeChecker
+  computervision_client = ComputerVisionClient(url, CognitiveServicesCredentials(key))
 
-    return new_func
 
-  return decorator
+def _progress(*args, **kwargs):
+  from tqdm.auto import tqdm
+  return tqdm(*args, **kwargs)
 
 
-@persist_to_file('.cache/_get_file_hash.json')
+@metrics.timed('hash')
 def get_file_hash(filename: str) -> str:
-  hash_alg = hashlib.sha256()
-  block_size = 65536
-  with open(filename, 'rb') as f:
-    chunk = f.read(block_size)
-    while len(chunk) > 0:
-      hash_alg.update(chunk)
-      chunk = f.read(block_size)
-  return hash_alg.hexdigest()
-
-
-def _limited(until):
-  duration = round(until - time.time(), 2)
+  return file_hashes.get_file_hash(filename)
+
+
+def _limited(duration):
+  metrics.add_seconds('rate_limit_sleep', duration)
   if duration > 1.0:
     logger.info('Rate limited, sleeping {:2.2f} seconds', duration)
 
 
-rate_limiter = RateLimiter(max_calls=20, period=61, callback=_limited)
+# see vision_pipeline.tier_profiles, 'F0' is the free tier (20 calls per 61 seconds)
+azure_tier = 'F0'
+# requests kept in flight by analyze_many
+azure_concurrency = 4
+# False in parallel chapter builds, where every process would have its own rate limit
+allow_azure_calls = True
+rate_limiter = vision_pipeline.TokenBucket(vision_pipeline.tier_profiles[azure_tier], callback=_limited)
+
+
+def set_azure_tier(tier: str, concurrency: int = azure_concurrency):
+  global azure_tier, azure_concurrency, rate_limiter
+  azure_tier = tier
+  azure_concurrency = concurrency
+  rate_limiter = vision_pipeline.TokenBucket(vision_pipeline.tier_profiles[tier], callback=_limited)
+
+# frames within this hamming distance (out of 64 bits) of a cluster's first frame reuse its analysis
+# instead of being sent to Azure; None sends every frame
+near_duplicate_distance: Optional[int] = 4
+
+# 'files' (pretty json per frame + per chapter), 'ndjson' (compact, one file per chapter) or 'off', see debug_sink
+debug_artifacts = 'files'
+_debug_sink: Optional[debug_sink.DebugSink] = None
+
+
+def get_debug_sink() -> debug_sink.DebugSink:
+  global _debug_sink
+  if _debug_sink is None or _debug_sink.mode != debug_artifacts:
+    make_directories()
+    if _debug_sink is not None:
+      _debug_sink.flush()
+    _debug_sink = debug_sink.DebugSink(debug_artifacts)
+  return _debug_sink
+
+# flagged frames are linked into .debug-class/<flag>/ ('hardlink', 'symlink', 'copy' or None), see classification_index
+debug_class_links: Optional[str] = 'hardlink'
+_classification_index: Optional[classification_index.ClassificationIndex] = None
+
+
+def get_classification_index() -> classification_index.ClassificationIndex:
+  global _classification_index
+  if _classification_index is None:
+    make_directories()
+    _classification_index = classification_index.ClassificationIndex('.debug-class/classification.jsonl',
+                                                                     debug_class_links)
+  return _classification_index
 
 
 def assert_phrases(phrases: List[str]) -> List[str]:
@@ -123,19 +182,46 @@ known_compounds = [
 ]
 
 
+def _compound_words(unique: Set[str]) -> Set[str]:
+  # x and y where x + y is also a phrase ('bath', 'tub', 'bathtub'), by splitting each phrase instead of trying all pairs
+  compound_words = set()
+  for p in unique:
+    for i in range(1, len(p)):
+      if p[:i] in unique and p[i:] in unique:
+        compound_words.add(p[:i])
+        compound_words.add(p[i:])
+  return compound_words
+
+
+def _contained_phrases(unique: Set[str]) -> Set[str]:
+  # every shorter run of whole words inside each phrase, i.e. exactly the to_find's that is_overlap(phrases, to_find) is
+  # True for: ' ' + to_find + ' ' is in ' ' + p + ' ' for some p != to_find
+  contained = set()
+  for p in unique:
+    words = p.split(' ')
+    n = len(words)
+    for i in range(n):
+      for j in range(i + 1, n + 1 if i else n):
+        contained.add(' '.join(words[i:j]))
+  return contained
+
+
+@metrics.timed('reducer')
 def _reducer(phrases: List[str]) -> Tuple[List[str], List[str]]:
   assert_phrases(phrases)
   kept, removed = [], []
-  more_generic_terms = (set(itertools.chain.from_iterable(get_generic_terms_for(w) for w in phrases)))
+  unique = set(phrases)
+  more_generic_terms = (set(itertools.chain.from_iterable(get_generic_terms_for(w) for w in unique)))
 
-  compound_words_list = [(x, y) for x in phrases for y in phrases if x + y in phrases]
-  compound_words = set(itertools.chain(*compound_words_list))
+  compound_words = _compound_words(unique)
   if compound_words:
     assert compound_words in known_compounds, (compound_words, phrases)
 
+  contained = _contained_phrases(unique)
+  kept_set = set()
   for i, k in enumerate(phrases):
     drop = False
-    drop = drop or k in kept
+    drop = drop or k in kept_set
 
     if not drop and k in compound_words:
       logger.trace('dropping compound: {} {} from {}', i, k, phrases)
@@ -145,10 +231,10 @@ def _reducer(phrases: List[str]) -> Tuple[List[str], List[str]]:
       logger.trace('dropping generic: {} {} from {}', i, k, phrases)
       drop = True
 
-    drop = drop or is_overlap(phrases, k)
+    drop = drop or k in contained
 
     for suff in ['s', 'ing', 'ness']:
-      if not drop and is_overlap_or_exact(phrases, k + suff):
+      if not drop and (k + suff in unique or k + suff in contained):
         logger.trace('drop {}: {} {} from {}', suff, i, k, phrases)
         drop = True
         if suff == 'ness':
@@ -158,9 +244,32 @@ def _reducer(phrases: List[str]) -> Tuple[List[str], List[str]]:
       removed.append(k)
       continue
     kept.append(k)
+    kept_set.add(k)
   return kept, removed
 
 
+reduce_memo_size = 4096
+
+
+def iter_reduce_many(phrase_lists: Iterable[List[str]]) -> Iterator[Tuple[List[str], List[str]]]:
+  # static shots repeat the same phrases frame after frame, so identical frames are only reduced once
+  memo: Dict[Tuple[str, ...], Tuple[List[str], List[str]]] = {}
+  for phrases in phrase_lists:
+    key = tuple(phrases)
+    if key in memo:
+      metrics.count('reducer_repeats')
+    else:
+      if len(memo) >= reduce_memo_size:
+        memo.clear()  # keeps memory bounded when streaming long chapters
+      memo[key] = _reducer(phrases)
+    kept, removed = memo[key]
+    yield list(kept), list(removed)
+
+
+def reduce_many(phrase_lists: Iterable[List[str]]) -> List[Tuple[List[str], List[str]]]:
+  return list(iter_reduce_many(phrase_lists))
+
+
 def reduce(phrases: List[str]) -> List[str]:
   # r_copy = list(reversed(phrases))
   kept, removed = _reducer(phrases)
@@ -170,47 +279,163 @@ def reduce(phrases: List[str]) -> List[str]:
   return kept
 
 
+_directories_made = False
+
+
+# the working directories, made by the first thing that writes into them rather than on import
+def make_directories():
+  global _directories_made
+  if not _directories_made:
+    for d in ['.cache', '.debug', '.debug-class', '.debug-lines', '.debug-parts']:
+      os.makedirs(d, exist_ok=True)
+    _directories_made = True
+
+
+_analysis_store: Optional[analysis_store.AnalysisStore] = None
+# written once every old .cache/<sha256>.pkl is in the store. an interrupted migration is run again (it skips the
+# pickles that are already there) until it's complete
+pickles_migrated_file = '.cache/analyses.migrated'
+
+
+def get_analysis_store() -> analysis_store.AnalysisStore:
+  global _analysis_store
+  if _analysis_store is None:
+    make_directories()
+    _analysis_store = analysis_store.AnalysisStore('.cache/analyses')
+    if not os.path.isfile(pickles_migrated_file):
+      _analysis_store.migrate_pickles('.cache')
+      open(pickles_migrated_file, 'wt').close()
+  return _analysis_store
+
+
+# frames are sent as upload_profile describes (None sends the png as it is), see upload_payload
+upload_profile: Optional[upload_payload.PayloadProfile] = upload_payload.PayloadProfile(1280, '.jpg', 90)
+
+
+# the store keys an analysis of the frame with this hash may be under, preferred first: the one for the current
+# upload_profile, then the full resolution one (which is at least as good, so existing analyses stay valid)
+def analysis_keys(file_hash: str) -> List[str]:
+  key = upload_payload.cache_key(file_hash, upload_profile)
+  return [key] if key == file_hash else [key, file_hash]
+
+
+def get_analysis(file_hash: str, prefetched: Optional[Dict[str, ImageAnalysis]] = None) -> Optional[ImageAnalysis]:
+  for key in analysis_keys(file_hash):
+    response = prefetched.get(key) if prefetched else None
+    if response is None:
+      response = get_analysis_store().get(key)
+    if response is not None:
+      return response
+  return None
+
+
+def is_analyzed(file_hash: str) -> bool:
+  store = get_analysis_store()
+  return any(key in store for key in analysis_keys(file_hash))
+
+
 def fast_isfile(filename: str) -> bool:
+  # the per-frame .cache/<sha256>.pkl files now live in the analysis store, so answer those from its index
+  if filename.startswith('.cache/') and filename.endswith('.pkl'):
+    return is_analyzed(filename[len('.cache/'):-len('.pkl')])
   return os.path.isfile(filename)
 
 
+def near_duplicates(files: List[str], hashes: Dict[str, str]) -> Dict[str, str]:
+  # files must be in playback order (i.e. sorted within one directory), hashes is file_hashes.hash_files(files)
+  if near_duplicate_distance is None:
+    return {}
+  return frame_dedup.collapse(files, [hashes[f] for f in files], near_duplicate_distance)
+
+
 # there are some weird json round-tripping issues with the Azure API's so it's safest to use python binary pickles
-def analyze(filename: str) -> Optional[ImageAnalysis]:
-  cache_file = '.cache/' + get_file_hash(filename) + '.pkl'
-  response: ImageAnalysis
-  if fast_isfile(cache_file):
-    with open(cache_file, 'rb') as source:
-      response = pickle.load(source)
+# prefetched is an optional {analysis key: analysis} from AnalysisStore.get_many
+# data is the encoded frame when it's streamed from the video (see iter_for_video), filename is then only its name
+# every frame counts one event: cache_hit, near_duplicate or cache_miss
+def analyze(filename: str, representative: Optional[str] = None,
+            prefetched: Optional[Dict[str, ImageAnalysis]] = None, data: Optional[bytes] = None,
+            file_hash: Optional[str] = None, representative_hash: Optional[str] = None) -> Optional[ImageAnalysis]:
+  if file_hash is None:
+    file_hash = hashlib.sha256(data).hexdigest() if data is not None else get_file_hash(filename)
+  response = get_analysis(file_hash, prefetched)
+  if response is not None:
+    metrics.count('cache_hit')
+  elif representative and representative != filename:
+    # near-duplicate of an earlier frame, so reuse that frame's analysis rather than spending an Azure call
+    metrics.count('near_duplicate')
+    if representative_hash is None:
+      representative_hash = get_file_hash(representative)
+    response = get_analysis(representative_hash, prefetched)
+    if response is None:
+      response = _analyze_with_azure(representative, representative_hash)
   else:
-    with rate_limiter:
-      response = computervision_client.analyze_image_in_stream(open(filename, 'rb'), visual_features=all_visual_features)
-    # save the python binary pickle for future use
-    with open(cache_file, 'wb') as output:
-      pickle.dump(response, output)
-
-  # for debugging purposes, we save a jsonpickle with some lines removed
-  # this is used in get_hierarchy
-  debug_json = '.debug/' + os.path.splitext(os.path.basename(filename))[0] + '.json'
-  if not fast_isfile(debug_json):
-    with open(debug_json, 'wt') as dj:
-      dj.writelines(filter_json(jsonpickle.encode(response, indent=4)))
+    metrics.count('cache_miss')
+    response = _analyze_with_azure(filename, file_hash, data)
+
+  # for debugging purposes, the analysis is also saved as json (in the background, see debug_sink)
+  get_debug_sink().analysis(filename, response)
   return response
 
 
-def filter_json(block: str) -> Iterable[str]:
-  for line in block.split('\n'):
-    if 'py/object' in line:
-      assert line.strip().endswith(','), line
-      continue
-    if ': {},' in line:      continue
-    yield line + '\n'
+def _analyze_with_azure(filename: str, file_hash: str, data: Optional[bytes] = None) -> ImageAnalysis:
+  assert allow_azure_calls, ('not analyzed yet, run bulk_downloader before a parallel build', filename)
+  call = _call_azure if data is None else lambda _: _analyze_bytes(data)
+  response = vision_pipeline.call_with_retries(filename, call, rate_limiter)
+  # save the python binary pickle for future use
+  get_analysis_store().put(upload_payload.cache_key(file_hash, upload_profile), response)
+  get_hierarchy().add_analysis(response)
+  return response
+
+
+def _call_azure(filename: str) -> ImageAnalysis:
+  with open(filename, 'rb') as image:
+    return _analyze_bytes(image.read())
+
+
+def _analyze_bytes(data: bytes) -> ImageAnalysis:
+  with metrics.stage('payload'):
+    payload = upload_payload.prepare(data, upload_profile)
+  if upload_profile is not None:
+    # every upload path comes through here, so the report shows the savings of analyze() as well as analyze_many
+    metrics.count('upload_bytes_sent', len(payload))
+    metrics.count('upload_bytes_saved', len(data) - len(payload))
+  with metrics.stage('azure_call'):
+    return get_client().analyze_image_in_stream(io.BytesIO(payload), visual_features=get_visual_features())
+
+
+# sends the frames that aren't cached yet to Azure with azure_concurrency requests in flight,
+# returns the number of Azure calls made (analyze() will then find everything in the store).
+# on_analyzed(file) is called as each file's analysis is stored
+def analyze_many(files: List[str], on_analyzed: Optional[Callable[[str], None]] = None) -> int:
+  store = get_analysis_store()
+  to_send = {}
+  for f in files:
+    h = get_file_hash(f)
+    if not is_analyzed(h) and h not in to_send:
+      to_send[h] = f
+  by_file = {f: h for h, f in to_send.items()}
+  for f, response in _progress(vision_pipeline.run_concurrently(to_send.values(), _call_azure, rate_limiter, azure_concurrency),
+                          total=len(to_send)):
+    store.put(upload_payload.cache_key(by_file[f], upload_profile), response)
+    get_hierarchy().add_analysis(response)
+    if on_analyzed:
+      on_analyzed(f)
+  if upload_profile is not None and to_send:
+    logger.info('uploads: {}', upload_payload.stats)
+  return len(to_send)
 
 
 all_celebs = set()
 
 
 # converts the full response to a list of phrases (including celebrities, description, etc.)
+@metrics.timed('extract_text')
 def extract_text(d: ImageAnalysis, filename_for_debugging: str = '') -> List[str]:
+  return extract_phrases(d, filename_for_debugging).texts()
+
+
+# the same phrases with where they came from, their confidence and the object they belong to
+def extract_phrases(d: ImageAnalysis, filename_for_debugging: str = '') -> phrase_records.PhraseSet:
   def _l(s: str):
     if s == "Petri dish":
       return s.lower()
@@ -218,68 +443,191 @@ def extract_text(d: ImageAnalysis, filename_for_debugging: str = '') -> List[str
       assert s.islower(), s
     return s
 
-  x = []
-
-  def _add(s):
-    nonlocal x
-    if s not in x:
-      x.append(s)
+  x = phrase_records.PhraseSet()
 
   found = False
   for c in d.description.captions:
     found = True
-    _add(c.text)  # not using c.confidence
+    x.add(c.text, 'caption', c.confidence)
 
   assert found, d.description
   for cat in d.categories:
     if cat.detail and cat.detail.celebrities:
       for celeb in cat.detail.celebrities:
         all_celebs.add(celeb.name)
-        _add(celeb.name)
+        x.add(celeb.name, 'celebrity', celeb.confidence)
   for t in d.description.tags:
-    _add(_l(t))
+    x.add(_l(t), 'tag')
   for tx in d.tags:
-    _add(_l(tx.name))
-  for o in d.objects:
-    _add(_l(o.object_property.lower()))
+    x.add(_l(tx.name), 'tag', tx.confidence)
+  for i, o in enumerate(d.objects):
+    x.add(_l(o.object_property.lower()), 'object', o.confidence, i)
 
   # there are a lot of mismatches between detected faces and celebrities/descriptions
   # but i'm not doing anything with those right now
-  for i, f in enumerate(d.faces):
-    found_gender = False
-    if f.gender == "Male" and not found_gender:
-      found_gender = 'man' in x or ' man ' in str(x) or ' man\'s ' in str(x) or 'boy' in x or ' men ' in str(x)
-    else:
-      assert f.gender == "Female"
-      found_gender = 'woman' in x or ' woman ' in str(x)
-    if not found_gender or len(d.faces) > 1:
-      logger.trace("{}: index #{}, age={}, gender: {} - {}", filename_for_debugging, i, f.age, f.gender, x)
+  if d.faces:
+    # newlines can't be part of the ' man ' etc. matches, so this finds them within single phrases
+    joined = '\n'.join(x.texts())
+    for i, f in enumerate(d.faces):
+      found_gender = False
+      if f.gender == "Male" and not found_gender:
+        found_gender = 'man' in x or ' man ' in joined or ' man\'s ' in joined or 'boy' in x or ' men ' in joined
+      else:
+        assert f.gender == "Female"
+        found_gender = 'woman' in x or ' woman ' in joined
+      if not found_gender or len(d.faces) > 1:
+        logger.trace("{}: index #{}, age={}, gender: {} - {}", filename_for_debugging, i, f.age, f.gender, x.texts())
 
   return x
 
 
+# workers > 1 builds the chapters in a process pool, which only uses already cached analyses (see bulk_downloader).
+# each chapter gets its own seed for textmods, so both modes write the same book.md for the same seed.
+# analyses_zip reads every analysis from an archive of json responses instead (see ZipAnalysisProvider)
+# profile is None, 'cprofile' (book.pstats) or 'tracemalloc' (book.tracemalloc.txt), of this process only
+def main(workers: int = 1, seed: int = 2021, analyses_zip: Optional[str] = None, profile: Optional[str] = None):
+  metrics.reset()
+  get_corpus().chapters.clear()
+  with metrics.profiling(profile, 'book.pstats' if profile == 'cprofile' else 'book.tracemalloc.txt'):
+    if workers > 1:
+      book = iter_book_parallel(workers, seed, analyses_zip)
+    else:
+      book = iter_book(seed, analysis_providers.ZipAnalysisProvider(analyses_zip) if analyses_zip else None)
+    writelines('book.md', book)
+    run_pandoc('book')
+  get_corpus().save(corpus_file)
+  metrics.write_json(metrics_report)
+  metrics.write_prometheus(metrics_prometheus)
+  logger.info('metrics: {}', metrics.book.as_dict())
+
+
+# where the time went, see metrics
+metrics_report = 'metrics.json'
+metrics_prometheus = 'metrics.prom'
+
+
+def chapter_seed(seed: int, name: str) -> int:
+  return int(hashlib.sha256((str(seed) + ':' + name).encode('utf-8')).hexdigest()[:16], 16)
+
+
+# what every chapter starts from in both modes: an rng of its own, and textmods' first-appearance order starts over,
+# because an order shared by the whole book would depend on which chapters a worker process built before
+def _begin_chapter(seed: int, directory: str) -> random.Random:
+  textmods.reset_appearance()
+  metrics.begin_chapter(directory)
+  return random.Random(chapter_seed(seed, directory))
+
+
 # noinspection PyUnresolvedReferences
-def main():
-  book = ['\pagebreak']
+def _book_rows() -> Iterator[Tuple[str, str]]:
+  import pandas as pd
   frame: pd.DataFrame = pd.read_excel('book.xlsx')
   for tup in frame.itertuples():
     if tup.year == 'skip':
       continue
-    logger.info('{} {}', tup.dir, tup.title)
-    book += gen_for_directory('easy/' + str(tup.dir), tup.title, filename=str(tup.dir) + '.md')
-    book += ['\pagebreak']
-
-  writelines('book.md', book)
-  run_pandoc('book')
-
-
-def run_pandoc(prefix: str, extra_args=None):
+    yield str(tup.dir), tup.title
+
+
+# every chapter's lines in spreadsheet order, each chapter is generated (and its .debug-parts file written)
+# only as the lines are consumed
+def iter_book(seed: int = 2021, provider: Optional[analysis_providers.ZipAnalysisProvider] = None) -> Iterator[str]:
+  yield '\\pagebreak'
+  for directory, title in _book_rows():
+    logger.info('{} {}', directory, title)
+    rng = _begin_chapter(seed, directory)
+    yield from iter_for_directory('easy/' + directory, title, filename=directory + '.md', rng=rng, provider=provider)
+    metrics.end_chapter()
+    yield '\\pagebreak'
+
+
+def iter_book_parallel(workers: int, seed: int = 2021, analyses_zip: Optional[str] = None) -> Iterator[str]:
+  yield '\\pagebreak'
+  rows = [(directory, title, seed, analyses_zip) for directory, title in _book_rows()]
+  if not analyses_zip:
+    # on a first run every worker would build .cache/hierarchy.jsonl from the store at once, and read the others'
+    # partial journals. built here, the workers inherit it. the same for the file hashes, which only this process
+    # compacts
+    get_hierarchy()
+    file_hashes.load()
+  context = multiprocessing.get_context(worker_start_method) if worker_start_method else None
+  with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                           initargs=(_worker_settings(),)) as pool:
+    # map() hands the results back in spreadsheet order
+    for (directory, _, _, _), (lines, chapters, celebs, chapter_metrics) in zip(rows, pool.map(_build_chapter, rows)):
+      for header, chapter in chapters.items():
+        get_corpus().add_portable_chapter(header, *chapter)
+      all_celebs.update(celebs)
+      metrics.add_chapter(directory, chapter_metrics)
+      yield from lines
+      yield '\\pagebreak'
+
+
+_worker_providers: Dict[str, analysis_providers.ZipAnalysisProvider] = {}
+
+# the pool's start method, None is the platform's default. Windows and macOS spawn the workers, which then import
+# this module's defaults, so the settings that change the book are passed to every worker (see _init_worker)
+worker_start_method: Optional[str] = None
+worker_settings = ['near_duplicate_distance', 'upload_profile', 'debug_artifacts', 'debug_class_links',
+                   'memoize_chapters', 'chapter_version', 'skip_phrases', 'phrase_replacements', 'known_compounds',
+                   'reduce_memo_size', 'prefetch_size', 'azure_tier', 'azure_concurrency']
+
+
+def _worker_settings() -> dict:
+  return {name: globals()[name] for name in worker_settings}
+
+
+def _init_worker(settings: dict):
+  # runs once in every worker process, before it builds any chapter
+  global allow_azure_calls
+  globals().update(settings)
+  set_azure_tier(azure_tier, azure_concurrency)
+  allow_azure_calls = False
+  file_hashes.compact_journal = False
+
+
+def _build_chapter(row: Tuple[str, str, int, Optional[str]]) -> Tuple[List[str], Dict[str, tuple], set, dict]:
+  # runs in a worker process, returns this chapter's contribution to the corpus, all_celebs and metrics
+  # for the parent. the corpus goes back as portable chapters, phrase ids are only assigned by the parent
+  directory, title, seed, analyses_zip = row
+  provider = None
+  if analyses_zip:
+    # one open archive (and LRU) per worker process, shared by the chapters it builds
+    if analyses_zip not in _worker_providers:
+      _worker_providers[analyses_zip] = analysis_providers.ZipAnalysisProvider(analyses_zip)
+    provider = _worker_providers[analyses_zip]
+  corpus = get_corpus()
+  corpus.chapters.clear()
+  all_celebs.clear()
+  logger.info('{} {}', directory, title)
+  rng = _begin_chapter(seed, directory)
+  lines = gen_for_directory('easy/' + directory, title, filename=directory + '.md', rng=rng, provider=provider)
+  # pool workers don't run atexit handlers
+  get_debug_sink().flush()
+  frame_dedup.flush()
+  chapters = {header: corpus.portable_chapter(header) for header in corpus.chapters}
+  return lines, chapters, set(all_celebs), metrics.end_chapter()
+
+
+# run_pandoc converts each chapter to LaTeX on its own and keeps the fragments in pdf_fragments, so after a change
+# only the changed chapters are converted again (see pandoc_fragments). False converts the whole book every time
+incremental_pdf = True
+pdf_fragments = '.cache/latex'
+
+
+@metrics.timed('pandoc')
+def run_pandoc(prefix: str, extra_args=None, incremental: Optional[bool] = None):
+  source = prefix + '.md'
+  template_args = []
+  if incremental_pdf if incremental is None else incremental:
+    source = pandoc_fragments.assemble(source, pdf_fragments)
+    template_args = pandoc_fragments.template_args(source)
   command = ['pandoc',
-             prefix + '.md',
+             source,
              '--toc', '-N',  # toc with numbering
              'pandoc.yaml',  # metadata
              '-H', 'pandoc.tex',  # header and margin settings
              '-V', 'subparagraph']  # workaround per https://jdhao.github.io/2019/05/30/markdown2pdf_pandoc/
+  command += template_args
   if extra_args:
     command += extra_args
   command += [
@@ -290,101 +638,354 @@ def run_pandoc(prefix: str, extra_args=None):
 
 
 def writelines(outfile: str, values: Iterable[str]) -> str:
+  for _ in write_through(outfile, values):
+    pass
+  return outfile
+
+
+# writes (and flushes) each value to outfile as it is produced, while passing it on
+def write_through(outfile: str, values: Iterable[str]) -> Iterator[str]:
+  make_directories()
   with open(outfile, 'wt', encoding='utf-8') as out:
     lines = 0
     spaces = 0
     chars = 0
     sentences = 0
     for v in values:
-      out.write(v)
-      out.write('\n\n')
+      with metrics.stage('write'):
+        out.write(v)
+        out.write('\n\n')
+        out.flush()
       if v:
         lines += 1
         chars += len(v)
       spaces += v.count(' ')
       sentences += v.count('.')
+      yield v
     out.close()
     logger.info('wrote {} lines to {} ({} words, {} sentences, {} chars)', lines, outfile, spaces, sentences, chars)
 
-  return outfile
 
+def _chapter_files(directory, provider: Optional[analysis_providers.ZipAnalysisProvider] = None) -> List[str]:
+  assert not directory.endswith('/'), directory
+  if provider:
+    files = provider.frames(directory)
+  else:
+    files = glob.glob(directory + '/*.png')
+  files.sort()
+  assert files, directory
+  return files
+
+
+# rng is used by textmods when randomize_order is set, the global random module by default.
+# with a provider (e.g. ZipAnalysisProvider) the frames and their analyses come from it instead of the .png files
+def gen_for_directory(directory, header, filename: str = '', window: int = 4, randomize_order: bool = True,
+                      rng: Optional[random.Random] = None,
+                      provider: Optional[analysis_providers.ZipAnalysisProvider] = None):
+  return list(iter_for_directory(directory, header, filename, window, randomize_order, rng, provider))
 
-def gen_for_directory(directory, header, filename: str = '', window: int = 4, randomize_order: bool = True):
+
+def iter_for_directory(directory, header, filename: str = '', window: int = 4,
+                       randomize_order: bool = True, rng: Optional[random.Random] = None,
+                       provider: Optional[analysis_providers.ZipAnalysisProvider] = None) -> Iterator[str]:
   if not filename:
     filename = directory + '.md'
 
   assert filename.endswith('.md'), filename
-  assert not directory.endswith('/'), directory
-  files = glob.glob(directory + '/*.png')
-  files.sort()
-  assert files, directory
-  w4 = gen_one_chapter(header, files, window, randomize_order)
-  writelines('.debug-parts/' + filename, w4)
-  return w4
+  files = _chapter_files(directory, provider)
+  part_file = '.debug-parts/' + filename
+  # only with an rng of its own the chapter is the same every time, and a provider's frames have no file hashes
+  key = None
+  if memoize_chapters and rng is not None and not provider:
+    key = _chapter_key(header, files, window, randomize_order, rng)
+  cached = get_chapter_cache().get(key, part_file) if key else None
+  if cached and not _generic_terms_changed(cached[1]['generic_terms']):
+    lines, summary = cached
+    logger.info('{}: {} lines from {}', header, len(lines), part_file)
+    metrics.count('chapter_cache_hit')
+    get_corpus().add_portable_chapter(header, *summary['phrases'])
+    all_celebs.update(summary['celebs'])
+    version, internal, gauss = summary['rng']
+    rng.setstate((version, tuple(internal), gauss))
+    yield from lines
+    return
+
+  # the celebrities of this chapter alone go in its summary, and the generic terms the reducer looked up
+  global _generic_lookups
+  celebs = set(all_celebs)
+  all_celebs.clear()
+  _generic_lookups = {}
+  count = 0
+  try:
+    for line in write_through(part_file, iter_one_chapter(header, files, window, randomize_order, rng=rng,
+                                                          provider=provider)):
+      count += 1
+      yield line
+  finally:
+    chapter_celebs = set(all_celebs)
+    all_celebs.update(celebs)
+    lookups, _generic_lookups = _generic_lookups, None
+  if key:
+    metrics.count('chapter_cache_miss')
+    texts, ids, offsets = get_corpus().portable_chapter(header)
+    get_chapter_cache().put(key, part_file, count, {'phrases': [texts, ids.tolist(), offsets.tolist()],
+                                                    'celebs': sorted(chapter_celebs), 'rng': rng.getstate(),
+                                                    'generic_terms': lookups})
+
+
+# gen_for_directory and main() reuse a chapter's .debug-parts file when nothing that goes into it changed
+# (see chapter_cache). bump chapter_version when the text pipeline changes in a way that changes chapters.
+# the object hierarchy grows while frames are analyzed, so instead of being part of the key, the summary has the
+# generic terms of every phrase the reducer looked up, and the chapter is only reused if they're still the same
+memoize_chapters = True
+chapter_version = 3
+_chapter_cache: Optional[chapter_cache.ChapterCache] = None
+
+
+def get_chapter_cache() -> chapter_cache.ChapterCache:
+  global _chapter_cache
+  if _chapter_cache is None:
+    make_directories()
+    _chapter_cache = chapter_cache.ChapterCache('.cache/chapters')
+  return _chapter_cache
+
+
+def _generic_terms_changed(generic_terms: Dict[str, Optional[List[str]]]) -> bool:
+  return any(get_generic_terms_for(word) != terms for word, terms in generic_terms.items())
+
+
+def _chapter_key(header, files: List[str], window, randomize_order, rng: random.Random) -> str:
+  hashes = file_hashes.hash_files(files)
+  return chapter_cache.chapter_key({
+    'version': chapter_version,
+    'header': header,
+    'frames': [hashes[f] for f in files],
+    'window': window,
+    'randomize_order': randomize_order,
+    'rng': rng.getstate(),
+    'skip': sorted(skip_phrases),
+    'replacements': phrase_replacements,
+    # what else decides which analyses the frames get
+    'upload_profile': upload_profile.name if upload_profile else None,
+    'near_duplicate_distance': near_duplicate_distance,
+  })
+
+
+# first-time processing of a new video: frames go from the decoder to Azure in memory instead of through pngs on disk,
+# which are only written if frames_dir is given (e.g. 'easy'). scenes (generate_frames.SceneSampling) only sends the
+# frames at scene changes
+def iter_for_video(video_file, header, interval: int = 1000, window: int = 4, randomize_order: bool = True,
+                   rng: Optional[random.Random] = None, frames_dir: Optional[str] = None, scenes=None) -> Iterator[str]:
+  import generate_frames  # only needed for videos
+  directory = generate_frames.frames_directory(video_file, frames_dir or 'easy', interval, scenes)
+  frames = ((generate_frames.frame_path(video_file, frames_dir or 'easy', interval, timestamp, scenes), data)
+            for timestamp, data in generate_frames.iter_frames(video_file, interval, pathOut=frames_dir, scenes=scenes))
+  keeps = iter_chapter_phrases(header, [], analyses=iter_streamed_analyses(frames))
+  yield from write_through('.debug-parts/' + os.path.basename(directory) + '.md',
+                           iter_window(header, keeps, window, randomize_order, rng=rng))
+
+
+# for tuning the window: analyzes and reduces the frames once, then runs the cheap window pass for every window,
+# returns {window: (lines, word count)}
+def gen_for_windows(directory, header, windows: Iterable[int], randomize_order: bool = False,
+                    include_removed: bool = False, rng: Optional[random.Random] = None,
+                    provider: Optional[analysis_providers.ZipAnalysisProvider] = None) -> Dict[int, Tuple[List[str], int]]:
+  keeps = gen_chapter_phrases(header, _chapter_files(directory, provider), provider)
+  ret = {}
+  for w in windows:
+    lines = apply_window(header, keeps, w, randomize_order, include_removed, rng)
+    ret[w] = (lines, word_count(lines))
+    logger.info('{}: window {}: {} words', header, w, ret[w][1])
+  return ret
 
 
-global_phrases = Counter()
+def word_count(lines: List[str]) -> int:
+  return len(' '.join(lines).split(' '))
 
 
-def gen_one_chapter(header, all_inputs, window, randomize_order, include_removed=False):
-  lines = ['# ' + header]
+# the phrases of every chapter's frames, for statistics over the whole book (see phrase_vocab).
+# the vocabulary of phrase ids is kept across runs, the corpus of the last build is saved to corpus_file by main()
+phrase_vocabulary_file = '.cache/phrases.jsonl'
+corpus_file = '.cache/corpus.npz'
+_corpus: Optional[phrase_vocab.Corpus] = None
+
+
+def get_corpus() -> phrase_vocab.Corpus:
+  global _corpus
+  if _corpus is None:
+    import phrase_vocab  # numpy, only once chapters are built
+    make_directories()
+    _corpus = phrase_vocab.Corpus(phrase_vocab.Vocabulary(phrase_vocabulary_file))
+  return _corpus
+
+
+# frames whose analyses are bulk-loaded from the store at a time
+prefetch_size = 256
 
-  skip = {"mammal", "person", "land vehicle", "portrait photography", "linedrawing", 'screenshot', 'text', 'font',
-          'wearing'}
-  all_phrases = Counter()
-  keeps = []
-  missing = 0
-  for f in tqdm(all_inputs):
-    d = analyze(f)
-    if d is None:
-      missing += 1
-      continue
 
-    if d.adult.is_adult_content:
-      save_class(f, '.debug-class/adult/')
-    if d.adult.is_racy_content:
-      save_class(f, '.debug-class/racy/')
-    if d.adult.is_gory_content:
-      save_class(f, '.debug-class/gory/')
+def gen_one_chapter(header, all_inputs, window, randomize_order, include_removed=False, rng=None, provider=None):
+  return list(iter_one_chapter(header, all_inputs, window, randomize_order, include_removed, rng, provider))
 
-    phrases = extract_text(d, f)
-    reduced_phrases, removed = _reducer(phrases)
 
-    keep = []
-    for p in reduced_phrases:
-      if p in skip:
-        removed.append(p)
+# the chapter is a chain of lazy stages, so memory stays bounded and lines come out while frames are still analyzed:
+# frames -> analyses -> phrases -> reduced phrases -> windowed, formatted lines
+def iter_one_chapter(header, all_inputs, window, randomize_order, include_removed=False, rng=None,
+                     provider=None) -> Iterator[str]:
+  keeps = iter_chapter_phrases(header, all_inputs, provider)
+  return iter_window(header, keeps, window, randomize_order, include_removed, rng)
+
+
+# yields (frame, file hash, analysis), the hash is None when replaying from a provider
+def iter_analyses(header, all_inputs, provider: Optional[analysis_providers.ZipAnalysisProvider] = None
+                  ) -> Iterator[Tuple[str, Optional[str], ImageAnalysis]]:
+  missing = 0
+  if provider:
+    # read-only replay, no hashing, cache or Azure
+    for f in _progress(all_inputs):
+      d = provider.get(f)
+      if d is None:
+        missing += 1
+        continue
+      yield f, None, d
+    if missing:
+      logger.info('{}: missing file count: {} of {}', header, missing, len(all_inputs))
+    return
+
+  # the hashes are only timed here, the stages below use them instead of get_file_hash
+  with metrics.stage('hash'):
+    hashes = file_hashes.hash_files(all_inputs)
+  with metrics.stage('near_duplicates'):
+    representatives = near_duplicates(all_inputs, hashes)
+  bar = _progress(total=len(all_inputs))
+  for chunk_start in range(0, len(all_inputs), prefetch_size):
+    chunk = all_inputs[chunk_start:chunk_start + prefetch_size]
+    with metrics.stage('cache_read'):
+      prefetched = get_analysis_store().get_many(
+        itertools.chain.from_iterable(analysis_keys(hashes[f]) for f in chunk + [representatives.get(f, f) for f in chunk]))
+    for f in chunk:
+      bar.update()
+      r = representatives.get(f)
+      d = analyze(f, r, prefetched, file_hash=hashes[f], representative_hash=hashes[r] if r else None)
+      if d is None:
+        missing += 1
         continue
-      q = p[0].upper() + p[1:]
-      q = q.replace('et al.', 'and others')
-      q = q.replace('christmas', 'Christmas')
-      q = q.replace('George Holz', 'Madonna')  # what is this i don't even
-      q = q.replace('Qr code', 'QR code')
-      q = q.replace('Pc game', 'PC game')
-      q = q.replace('Close up', 'Close-up')
-      q = q.replace('close up', 'close-up')
-      q = q.replace('Cg artwork', 'Computer-generated artwork')
-      q = q.replace('Linedrawing', 'Line drawing')
-      keep.append(q)
-
-    all_phrases.update(keep)
-    global_phrases.update(keep)
-    keeps.append((keep, removed))
-
-  for ig in skip:
-    assert ig not in all_phrases
-
-  logger.info('{}: most common: {}', header, all_phrases.most_common(20))
+      yield f, hashes[f], d
+  bar.close()
   if missing:
     logger.info('{}: missing file count: {} of {}', header, missing, len(all_inputs))
 
-  with open('.debug-lines/' + header + '.json', 'wt') as json_dump:
-    json.dump([k[0] for k in keeps], json_dump, indent=2)
 
+# the same as iter_analyses for frames that are only in memory, (frame name, png bytes) in playback order
+def iter_streamed_analyses(frames: Iterable[Tuple[str, bytes]]) -> Iterator[Tuple[str, str, ImageAnalysis]]:
+  rep_dhash, rep_response = None, None
+  for f, data in _progress(frames):
+    with metrics.stage('hash'):
+      file_hash = hashlib.sha256(data).hexdigest()
+    near = False
+    if near_duplicate_distance is not None:
+      # frame_dedup.collapse, one frame at a time
+      current = frame_dedup.get_dhash(f, file_hash, data)
+      near = rep_dhash is not None and frame_dedup.hamming(current, rep_dhash) <= near_duplicate_distance
+      if not near:
+        rep_dhash = current
+    if near and not is_analyzed(file_hash):
+      metrics.count('near_duplicate')
+      response = rep_response
+      get_debug_sink().analysis(f, response)
+    else:
+      response = analyze(f, data=data, file_hash=file_hash)
+      if not near:
+        rep_response = response
+    yield f, file_hash, response
+
+
+def iter_phrases(analyses: Iterable[Tuple[str, Optional[str], ImageAnalysis]]) -> Iterator[List[str]]:
+  index = get_classification_index()
+  for f, file_hash, d in analyses:
+    if file_hash is None:
+      # replays don't hash, keep the hash an earlier build recorded for the frame
+      file_hash = index.known_hash(f)
+    index.add(classification_index.record_for(f, file_hash, d.adult))
+    yield extract_text(d, f)
+
+
+def gen_chapter_phrases(header, all_inputs, provider=None) -> List[Tuple[List[str], List[str]]]:
+  return list(iter_chapter_phrases(header, all_inputs, provider))
+
+
+# reduced phrases that are dropped, and replacements for the ones that are kept (after capitalizing them), in order
+skip_phrases = {"mammal", "person", "land vehicle", "portrait photography", "linedrawing", 'screenshot', 'text', 'font',
+                'wearing'}
+phrase_replacements = [
+  ('et al.', 'and others'),
+  ('christmas', 'Christmas'),
+  ('George Holz', 'Madonna'),  # what is this i don't even
+  ('Qr code', 'QR code'),
+  ('Pc game', 'PC game'),
+  ('Close up', 'Close-up'),
+  ('close up', 'close-up'),
+  ('Cg artwork', 'Computer-generated artwork'),
+  ('Linedrawing', 'Line drawing'),
+]
+
+
+# analyzes + reduces every frame, yields (kept phrases, removed phrases) for each frame
+# analyses replaces the frames of all_inputs, e.g. with iter_streamed_analyses
+def iter_chapter_phrases(header, all_inputs, provider=None,
+                         analyses: Optional[Iterable[Tuple[str, Optional[str], ImageAnalysis]]] = None) -> Iterator[Tuple[List[str], List[str]]]:
+  global _replay_hierarchy
+  corpus = get_corpus()
+  frames = corpus.chapter_builder()
+  sink = get_debug_sink()
+  sink.begin_lines(header)
+  previous_hierarchy = _replay_hierarchy
+  if provider:
+    _replay_hierarchy = provider.hierarchy()
+  try:
+    if analyses is None:
+      analyses = iter_analyses(header, all_inputs, provider)
+    for reduced_phrases, removed in iter_reduce_many(iter_phrases(analyses)):
+      keep = []
+      for p in reduced_phrases:
+        if p in skip_phrases:
+          removed.append(p)
+          continue
+        q = p[0].upper() + p[1:]
+        for old, new in phrase_replacements:
+          q = q.replace(old, new)
+        keep.append(q)
+
+      frames.add_frame(keep)
+      sink.add_line(header, keep)
+      yield keep, removed
+  finally:
+    _replay_hierarchy = previous_hierarchy
+    sink.end_lines(header)
+
+  corpus.chapters[header] = frames.stats()
+  counts = corpus.counts(header)
+  for ig in skip_phrases:
+    i = corpus.vocabulary.id_of(ig)
+    assert i is None or not counts[i]
+
+  logger.info('{}: most common: {}', header, corpus.most_common(20, header))
+
+
+def apply_window(header, keeps, window, randomize_order, include_removed=False, rng=None) -> List[str]:
+  return list(iter_window(header, keeps, window, randomize_order, include_removed, rng))
+
+
+# drops phrases that were already used within the last `window` lines, keeps isn't modified
+def iter_window(header, keeps: Iterable[Tuple[List[str], List[str]]], window, randomize_order,
+                include_removed=False, rng: Optional[random.Random] = None) -> Iterator[str]:
+  yield '# ' + header
   line = 0
   next_at = {}
 
   for full_line, removed in keeps:
+    # timed without the yields, which would count the consumer's time (and pulling keeps, the upstream stages')
+    start = time.perf_counter()
+    removed = list(removed)
     line = line + 1
     kept = []
     for k in full_line:
@@ -399,65 +1000,89 @@ def gen_one_chapter(header, all_inputs, window, randomize_order, include_removed
     if not include_removed or not removed:
       removed_strike = ''
     if not kept:
-      lines.append('')
+      metrics.add_seconds('window', time.perf_counter() - start)
+      yield ''
       if removed_strike:
-        lines.append(removed_strike)
+        yield removed_strike
       line = line - 1
       continue
 
     kept_periods = [k + '.' for k in kept]
     if randomize_order:
-      kept_periods = textmods.do_anything(kept_periods)
+      # one line at a time with the chapter's rng, the same sequence as do_anything_many, so lines stream out
+      kept_periods = textmods.do_anything(kept_periods, rng)
 
     t = ' '.join(kept_periods) + ' ' + removed_strike
     t = t.strip()
-    lines.append(t)
-  return lines
+    metrics.add_seconds('window', time.perf_counter() - start)
+    yield t
 
 
-def save_class(f, p):
-  os.makedirs(p, exist_ok=True)
-  shutil.copy(f, p)
+bulk_queue_file = '.cache/bulk_queue.jsonl'
+# frames taken from the queue at a time, each batch is sent with analyze_many
+bulk_batch_size = 256
 
 
-def bulk_downloader():
-  globs = ['easy/*/*.png']
-  files = (
-      get_bulk_files(8, globs) +
-      get_bulk_files(4, globs) +
-      get_bulk_files(2, globs) +
-      get_bulk_files(1, globs))
-
-  seen = set()
-  uniques = []
-  for f in files:
-    if f not in seen:
-      uniques.append(f)
-      seen.add(f)
-  assert len(uniques) < len(files)
+# queues the frames of new or changed directories, every 8th frame of each video first, see job_queue
+# every frame is stat'ed on every start: a frame that was regenerated in place doesn't change its directory's mtime,
+# but its own size or mtime, which queues it again
+def scan_for_frames(queue: job_queue.JobQueue, globs: List[str]) -> int:
+  new = 0
+  for g in globs:
+    for directory in sorted(glob.glob(os.path.dirname(g))):
+      files = sorted(glob.glob(os.path.join(directory, os.path.basename(g))))
+      jobs = []
+      for i, f in enumerate(files):
+        st = os.stat(f)
+        jobs.append((f, job_queue.refinement_priority(i), [st.st_size, st.st_mtime_ns]))
+      new += queue.add(jobs)
+  return new
 
-  needed = []
-  for f in uniques:
-    if not fast_isfile('.cache/' + get_file_hash(f) + '.pkl'):
-      needed.append(f)
 
-  for f in tqdm(needed):
-    a = analyze(f)
-    assert a, f
+def bulk_status(queue: job_queue.JobQueue) -> str:
+  eta = queue.eta(rate_limiter.rate)
+  return '{} frames queued {}, ETA {} at {:.1f} calls/min'.format(
+    len(queue), queue.depth_by_priority(), datetime.timedelta(seconds=round(eta)) if eta != float('inf') else '-',
+    rate_limiter.rate * 60)
 
-  return True
 
+def bulk_downloader():
+  make_directories()
+  queue = job_queue.JobQueue(bulk_queue_file)
+  try:
+    new = scan_for_frames(queue, ['easy/*/*.png'])
+    logger.info('{} new frames, {}', new, bulk_status(queue))
+    representatives = {}
+    while True:
+      batch = queue.take(bulk_batch_size)
+      if not batch:
+        break
+      finished = [f for f in batch if not os.path.isfile(f)]  # deleted since they were queued
+      batch = [f for f in batch if os.path.isfile(f)]
+      file_hashes.hash_files(batch)
+      waiting = defaultdict(list)  # representative -> the frames its analysis covers
+      for f in batch:
+        directory = os.path.dirname(f)
+        if directory not in representatives:
+          directory_files = sorted(glob.glob(os.path.join(directory, '*.png')))
+          representatives[directory] = near_duplicates(directory_files, file_hashes.hash_files(directory_files))
+        # only the first frame of a run of near-duplicates needs to go to Azure
+        r = representatives[directory].get(f, f)
+        if is_analyzed(get_file_hash(f)) or is_analyzed(get_file_hash(r)):
+          finished.append(f)
+        else:
+          waiting[r].append(f)
+      queue.done(finished)
+
+      analyze_many(list(waiting), on_analyzed=lambda r: queue.done(waiting[r]))
+      for r, covered in waiting.items():
+        assert is_analyzed(get_file_hash(r)), r
+        queue.done(covered)
+      logger.info(bulk_status(queue))
+  finally:
+    queue.close()
 
-def get_bulk_files(divisor, globs):
-  ret = []
-  for g in globs:
-    files = glob.glob(g)
-    assert files, g
-    tmp = [f for i, f in enumerate(files) if i % divisor == 0]
-    assert tmp, g
-    print(g, len(files), len(tmp))
-    ret.extend(tmp)
-  return ret
+  return True
 
 
 # noinspection PyBroadException
@@ -468,67 +1093,48 @@ def retry_bulk():
       success = bulk_downloader()
       return success
     except:
+      # throttling (429) is already retried per request using Retry-After, so this is for everything else
       logger.exception('ignoring')
       time.sleep(61)
       continue
 
 
-def extract_parent_path(o):
-  path = []
-  while o:
-    path.append(o['object_property'].lower())
-    o = o['parent']
-  return path
+_hierarchy: Optional[hierarchy.Hierarchy] = None
 
 
-def get_generic_terms_for(word) -> List[str]:
-  to_generic = _get_to_generic()
-  if word not in to_generic:
-    return []
-  parent = to_generic[word]
-  return [parent] + get_generic_terms_for(parent)
-
-
-def _get_to_generic():
-  return build_hierarchy("2")
-
-
-@persist_to_file('.cache/hierarchy.json')
-def build_hierarchy(version: str):
-  # this can take >= 20 seconds to run, so increment version above when there are "a lot" of new json files to process
-  logger.info('building version {}', version)
-  paths = set()
-  to_generic = dict()
-  for j in glob.glob('.debug/*.json'):
-    with open(j, 'rt') as source:
-      obj = jsonpickle.loads(source.read())
-    for o in obj.get('objects', []):
-      if not o['parent']:
-        continue
-      p = tuple(extract_parent_path(o))
-      if p not in paths:
-        logger.info("{}", p)
-        paths.add(p)
-      for i in range(len(p) - 1):
-        child = p[i]
-        parent = p[i + 1]
-        if child in to_generic:
-          assert to_generic[child] == parent, (child, parent, to_generic)
-        to_generic[child] = parent
+def get_hierarchy() -> hierarchy.Hierarchy:
+  global _hierarchy
+  if _hierarchy is None:
+    make_directories()
+    _hierarchy = hierarchy.Hierarchy('.cache/hierarchy.jsonl')
+    if not _hierarchy.exists:
+      # first run: learn from every analysis we already have, after that analyze() keeps it up to date
+      logger.info('building object hierarchy from {} analyses', len(get_analysis_store()))
+      for _, d in get_analysis_store().items():
+        _hierarchy.add_analysis(d)
+      open(_hierarchy.journal_file, 'at').close()
+      logger.info('specific terms: {}', len(_hierarchy.to_generic))
+  return _hierarchy
 
-  logger.info('specific terms: {}', len(to_generic))
-  return to_generic
 
+# replaces get_hierarchy() while a provider's chapter is reduced, see iter_chapter_phrases
+_replay_hierarchy: Optional[hierarchy.Hierarchy] = None
+# word -> its generic terms, while a chapter is built for the chapter cache (None if they changed during the chapter)
+_generic_lookups: Optional[Dict[str, Optional[List[str]]]] = None
+
+
+def get_generic_terms_for(word) -> List[str]:
+  terms = (_replay_hierarchy or get_hierarchy()).get_generic_terms_for(word)
+  if _generic_lookups is not None and _generic_lookups.setdefault(word, terms) != terms:
+    _generic_lookups[word] = None
+  return terms
 
-for _d in ['.cache', '.debug', '.debug-class', '.debug-lines', '.debug-parts']:
-  if not os.path.isdir(_d):
-    os.makedirs(_d)
 
 if __name__ == "__main__":
   retry_bulk()
-  main()
+  main(workers=os.cpu_count() or 1)
   if all_celebs:
     logger.info("{}", all_celebs)
-  if global_phrases:
-    logger.info('global most common: {}', global_phrases.most_common(20))
+  if get_corpus().chapters:
+    logger.info('global most common: {}', get_corpus().most_common(20))
   logger.info('done')
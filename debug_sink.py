@@ -0,0 +1,146 @@
+import atexit
+import json
+import os
+import queue
+import textwrap
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from loguru import logger
+
+# debug artifacts (the analyses as json, the un-simplified lines of each chapter) are encoded and written on a
+# background thread, behind a bounded queue so a slow disk only ever holds up the pipeline by max_pending items.
+#   'files'  - one pretty-printed .debug/<frame>.json per frame and .debug-lines/<header>.json, as always
+#   'ndjson' - compact newline-delimited json, one .debug/<video>.ndjson and .debug-lines/<header>.ndjson per chapter,
+#              each kept open while the chapter is built (and closed by flush)
+#   'off'    - nothing is written, for production builds
+modes = ('files', 'ndjson', 'off')
+
+
+def filter_json(block: str) -> Iterable[str]:
+  for line in block.split('\n'):
+    if 'py/object' in line:
+      assert line.strip().endswith(','), line
+      continue
+    if ': {},' in line:      continue
+    yield line + '\n'
+
+
+class DebugSink:
+  def __init__(self, mode: str = 'files', max_pending: int = 256):
+    assert mode in modes, (mode, modes)
+    self.mode = mode
+    self.max_pending = max_pending
+    self._pending: Optional[queue.Queue] = None
+    self._pid = None
+    # only touched by the writer thread
+    self._open: Dict[str, object] = {}
+    self._separators: Dict[str, str] = {}
+    self._frames: Dict[str, Set[str]] = {}
+    self._analysis_files: Dict[str, object] = {}
+    atexit.register(self.flush)
+
+  def _submit(self, task: Callable[[], None]):
+    # a forked worker process inherits the queue but not the thread, so it gets its own
+    if self._pid != os.getpid():
+      self._pending = queue.Queue(self.max_pending)
+      self._pid = os.getpid()
+      threading.Thread(target=self._run, args=(self._pending,), daemon=True).start()
+    self._pending.put(task)
+
+  def _run(self, pending: queue.Queue):
+    while True:
+      task = pending.get()
+      try:
+        task()
+      except Exception:
+        logger.exception('writing debug artifacts')
+      finally:
+        pending.task_done()
+
+  def flush(self):
+    # waits for everything submitted so far to be written
+    if self._pending is not None and self._pid == os.getpid():
+      self._pending.put(self._close_analyses)
+      self._pending.join()
+
+  def analysis(self, filename: str, response):
+    if self.mode == 'off':
+      return
+    frame = os.path.splitext(os.path.basename(filename))[0]
+    if self.mode == 'files':
+      self._submit(lambda: self._write_analysis_json('.debug/' + frame + '.json', response))
+    else:
+      video = os.path.basename(os.path.dirname(filename.replace('\\', '/'))) or 'frames'
+      self._submit(lambda: self._append_analysis('.debug/' + video + '.ndjson', frame, response))
+
+  @staticmethod
+  def _write_analysis_json(debug_json: str, response):
+    if os.path.isfile(debug_json):
+      return
+    import jsonpickle  # on the writer thread, not when the module is imported
+    with open(debug_json, 'wt') as dj:
+      dj.writelines(filter_json(jsonpickle.encode(response, indent=4)))
+
+  def _append_analysis(self, path: str, frame: str, response):
+    if path not in self._frames:
+      # frames already in the file from earlier runs
+      self._frames[path] = set()
+      if os.path.isfile(path):
+        with open(path, 'rt', encoding='utf-8') as source:
+          for line in source:
+            try:
+              self._frames[path].add(json.loads(line)['frame'])
+            except (ValueError, KeyError):
+              continue
+    if frame in self._frames[path]:
+      return
+    self._frames[path].add(frame)
+    import jsonpickle
+    if path not in self._analysis_files:
+      self._analysis_files[path] = open(path, 'at', encoding='utf-8')
+    self._analysis_files[path].write('{"frame": ' + json.dumps(frame) + ', "analysis": ' +
+                                     jsonpickle.encode(response, unpicklable=False) + '}\n')
+
+  def _close_analyses(self):
+    for out in self._analysis_files.values():
+      out.close()
+    self._analysis_files.clear()
+
+  # the un-simplified, un-randomized phrases of every line of a chapter
+  def begin_lines(self, header: str):
+    if self.mode != 'off':
+      self._submit(lambda: self._begin_lines(self._lines_path(header)))
+
+  def add_line(self, header: str, keep: List[str]):
+    if self.mode != 'off':
+      self._submit(lambda: self._add_line(self._lines_path(header), keep))
+
+  def end_lines(self, header: str):
+    if self.mode != 'off':
+      self._submit(lambda: self._end_lines(self._lines_path(header)))
+
+  def _lines_path(self, header: str) -> str:
+    return '.debug-lines/' + header + ('.json' if self.mode == 'files' else '.ndjson')
+
+  def _begin_lines(self, path: str):
+    self._open[path] = open(path, 'wt', encoding='utf-8')
+    if self.mode == 'files':
+      self._open[path].write('[')
+      self._separators[path] = '\n'
+
+  def _add_line(self, path: str, keep: List[str]):
+    if self.mode == 'files':
+      # the same layout as json.dump(..., indent=2) of the whole chapter
+      self._open[path].write(self._separators[path] + textwrap.indent(json.dumps(keep, indent=2), '  '))
+      self._separators[path] = ',\n'
+    else:
+      self._open[path].write(json.dumps(keep) + '\n')
+
+  def _end_lines(self, path: str):
+    out = self._open.pop(path)
+    if self.mode == 'files':
+      out.write('\n]')
+    out.close()
+    # the chapter's frames have all been analyzed
+    self._close_analyses()
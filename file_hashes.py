@@ -0,0 +1,119 @@
+import hashlib
+import json
+import mmap
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+# sha256 of frames, remembered per (path, size, mtime_ns, inode) so a regenerated frame with the same name is
+# re-hashed instead of returning a stale hash. every new hash is appended to a json-lines journal right away,
+# so a crash loses nothing (the old .cache/_get_file_hash.json was only written at exit, and has no stat
+# information to validate against, so it isn't imported).
+
+journal_file = '.cache/_file_hashes.jsonl'
+
+# below this many stale files it's quicker to hash them in-process than to start a pool
+min_parallel = 16
+
+# compacting rewrites the journal, which would drop the lines other processes append meanwhile. so only the process
+# that starts the others compacts it (see load), cloud_vision's pool workers set this to False
+compact_journal = True
+
+_Stat = Tuple[int, int, int]
+_known: Optional[Dict[str, Tuple[_Stat, str]]] = None
+_lock = threading.Lock()
+
+
+def _stat_key(st: os.stat_result) -> _Stat:
+  return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+def _load():
+  global _known
+  if _known is not None:
+    return _known
+  _known = {}
+  lines = 0
+  try:
+    with open(journal_file, 'rt', encoding='utf-8') as source:
+      for line in source:
+        try:
+          path, size, mtime_ns, inode, digest = json.loads(line)
+        except ValueError:
+          continue  # torn last line from a crash
+        _known[path] = ((size, mtime_ns, inode), digest)
+        lines += 1
+  except IOError:
+    pass
+  if compact_journal and lines > 2 * len(_known) + 1000:
+    _compact()
+  return _known
+
+
+# reads (and compacts) the journal now, before starting processes that append to it
+def load():
+  with _lock:
+    _load()
+
+
+def _compact():
+  tmp = journal_file + '.tmp'
+  with open(tmp, 'wt', encoding='utf-8') as out:
+    for path, (st, digest) in _known.items():
+      out.write(json.dumps([path, *st, digest]) + '\n')
+  os.replace(tmp, journal_file)
+
+
+def _record(new: Iterable[Tuple[str, _Stat, str]]):
+  with _lock:
+    known = _load()
+    os.makedirs(os.path.dirname(journal_file) or '.', exist_ok=True)
+    with open(journal_file, 'at', encoding='utf-8') as out:
+      for path, st, digest in new:
+        known[path] = (st, digest)
+        out.write(json.dumps([path, *st, digest]) + '\n')
+
+
+def sha256_of(filename: str) -> str:
+  with open(filename, 'rb') as f:
+    if os.fstat(f.fileno()).st_size == 0:
+      return hashlib.sha256().hexdigest()
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+      return hashlib.sha256(m).hexdigest()
+
+
+def _lookup(filename: str) -> Tuple[str, _Stat, Optional[str]]:
+  path = os.path.abspath(filename)
+  st = _stat_key(os.stat(path))
+  known = _load().get(path)
+  return path, st, known[1] if known and known[0] == st else None
+
+
+def get_file_hash(filename: str) -> str:
+  path, st, digest = _lookup(filename)
+  if digest is None:
+    digest = sha256_of(path)
+    _record([(path, st, digest)])
+  return digest
+
+
+# hashes a whole directory's worth of frames, with the stale/unknown ones spread over a process pool
+def hash_files(filenames: Iterable[str], workers: Optional[int] = None) -> Dict[str, str]:
+  ret = {}
+  stale = []
+  for f in filenames:
+    path, st, digest = _lookup(f)
+    if digest is None:
+      stale.append((f, path, st))
+    else:
+      ret[f] = digest
+  if len(stale) < min_parallel:
+    digests = [sha256_of(path) for _, path, _ in stale]
+  else:
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+      digests = list(pool.map(sha256_of, [path for _, path, _ in stale], chunksize=8))
+  _record((path, st, digest) for (_, path, st), digest in zip(stale, digests))
+  for (f, _, _), digest in zip(stale, digests):
+    ret[f] = digest
+  return ret
@@ -0,0 +1,90 @@
+import atexit
+import json
+import os
+from typing import Dict, List, Optional
+
+# music videos have long static shots, so consecutive frames are often visually identical even when
+# their bytes (and sha256) differ. a 64 bit difference hash (dhash) is cheap to compute and robust to
+# compression noise, so frames within a small hamming distance of each other can share one Azure analysis.
+
+# file hash -> dhash. the clusters aren't cached, with the dhashes known they're one pass over the frames
+cache_file = '.cache/_near_duplicates.json'
+
+
+def _load_cache(file_name) -> Dict[str, str]:
+  try:
+    with open(file_name, 'r') as f:
+      return json.load(f)['dhash']
+  except (IOError, ValueError, KeyError):
+    return {}
+
+
+_cache: Optional[Dict[str, str]] = None
+# the dhashes computed since the last flush
+_unsaved: Dict[str, str] = {}
+
+
+# loaded on first use rather than on import
+def _get_cache() -> Dict[str, str]:
+  global _cache
+  if _cache is None:
+    _cache = _load_cache(cache_file)
+    atexit.register(flush)
+  return _cache
+
+
+# saves the new dhashes, merged with what other processes (e.g. the other pool workers) saved meanwhile.
+# pool workers don't run atexit handlers, so they call this after every chapter
+def flush():
+  if not _unsaved:
+    return
+  known = _load_cache(cache_file)
+  known.update(_unsaved)
+  os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+  tmp = '%s.%d.tmp' % (cache_file, os.getpid())
+  with open(tmp, 'w') as out:
+    json.dump({'dhash': known}, out, indent=2)
+  os.replace(tmp, cache_file)
+  _unsaved.clear()
+
+
+# data is the encoded image when it's streamed rather than read from filename
+def dhash(filename: str, data: Optional[bytes] = None) -> int:
+  import cv2
+  import numpy as np
+  if data is not None:
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+  else:
+    image = cv2.imread(filename, cv2.IMREAD_GRAYSCALE)
+  assert image is not None, filename
+  small = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+  value = 0
+  for bit in (small[:, 1:] > small[:, :-1]).flatten():
+    value = (value << 1) | int(bit)
+  return value
+
+
+def hamming(a: int, b: int) -> int:
+  return bin(a ^ b).count('1')
+
+
+def get_dhash(filename: str, file_hash: str, data: Optional[bytes] = None) -> int:
+  # keyed by the content hash, so renamed or regenerated frames are handled correctly
+  known = _get_cache()
+  if file_hash not in known:
+    known[file_hash] = _unsaved[file_hash] = '%016x' % dhash(filename, data)
+  return int(known[file_hash], 16)
+
+
+# maps each file (in playback order) to the representative of its cluster: the first frame of a run of frames
+# that are all within max_distance of it. representatives map to themselves.
+def collapse(files: List[str], file_hashes: List[str], max_distance: int) -> Dict[str, str]:
+  assert len(files) == len(file_hashes), (len(files), len(file_hashes))
+  ret = {}
+  rep, rep_hash = None, 0
+  for f, h in zip(files, file_hashes):
+    current = get_dhash(f, h)
+    if rep is None or hamming(current, rep_hash) > max_distance:
+      rep, rep_hash = f, current
+    ret[f] = rep
+  return ret
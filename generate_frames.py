@@ -1,19 +1,43 @@
 import argparse
+import math
 import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional
 
 import cv2
+import numpy as np
 
 print(cv2.__version__)
 
 # this is a rough approximation of ffmpeg -i $vid.mp4 -r 1 -f image2 $vid-%4d.png
 
-def extractImages(video_file, pathOut, interval, start_at = 0):
-  count = start_at
+# a segment costs one seek + decoder warm-up, so it isn't worth splitting videos into pieces shorter than this
+min_segment_ms = 60 * 1000
+
+
+# instead of every `interval` ms, only keep a frame when the scene changed: when it differs from the last kept frame
+# by at least threshold (mean absolute difference of small grayscale thumbnails, 0-1), and at least min_spacing_ms
+# after it. a frame is kept every max_spacing_ms regardless, so slow pans and static shots are still covered.
+# frames are then only scored every `interval` ms, and keep the names they'd have had without scene sampling.
+class SceneSampling(NamedTuple):
+  min_spacing_ms: int = 1000
+  max_spacing_ms: int = 8000
+  threshold: float = 0.08
+
+
+scene_thumbnail = (32, 18)
+
+
+def extractImages(video_file, pathOut, interval, start_at = 0, workers = None, scenes: Optional[SceneSampling] = None):
   vidcap = cv2.VideoCapture(video_file)
   just_name = os.path.splitext(os.path.basename(video_file))[0]
   base_out = pathOut + "\\" + just_name
   if interval != 1000:
     base_out = base_out + '@' + str(interval)
+  if scenes:
+    base_out = base_out + '@scenes'
   output_dir = base_out.replace('\\', '/')
   os.makedirs(base_out, exist_ok=True)
   print('base output directory: ', base_out)
@@ -21,19 +45,166 @@ def extractImages(video_file, pathOut, interval, start_at = 0):
   success, image = vidcap.read()
   if not success:
     assert False, video_file
-  print(vidcap.get(cv2.CAP_PROP_FRAME_COUNT), 'frames total')
-  print(vidcap.get(cv2.CAP_PROP_FPS), 'fps')
-  while success:
-    vidcap.set(cv2.CAP_PROP_POS_MSEC, (count * interval))  # added this line
-    success, image = vidcap.read()
+  frame_count = vidcap.get(cv2.CAP_PROP_FRAME_COUNT)
+  fps = vidcap.get(cv2.CAP_PROP_FPS)
+  print(frame_count, 'frames total')
+  print(fps, 'fps')
+  vidcap.release()
+
+  duration_ms = frame_count * 1000.0 / fps if fps > 0 else 0
+  # a scene change is decided from the last kept frame, which may be in the previous segment, so scene mode is one
+  # sequential decode (every segment would start with a kept frame, and the frames would depend on the workers)
+  segments = _split_segments(start_at, duration_ms, interval, 1 if scenes else workers or os.cpu_count() or 1)
+  if len(segments) == 1:
+    written = _extract_segment(video_file, base_out, interval, *segments[0], scenes)
+  else:
+    print(len(segments), 'segments')
+    with ProcessPoolExecutor(max_workers=len(segments)) as pool:
+      futures = [pool.submit(_extract_segment, video_file, base_out, interval, first, stop, scenes)
+                 for first, stop in segments]
+      written = sum(f.result() for f in futures)
+  print('\ncompleted', written, 'frames')
+  return output_dir
+
+
+def _split_segments(start_at, duration_ms, interval, workers):
+  # returns [(first count, stop count)], the last segment is open-ended (stop = None) because frame counts
+  # reported by containers are only estimates
+  if duration_ms <= 0:
+    return [(start_at, None)]
+  total = math.ceil(duration_ms / interval) - start_at
+  n = min(workers, total * interval // min_segment_ms)
+  if n <= 1:
+    return [(start_at, None)]
+  per_segment = math.ceil(total / n)
+  firsts = list(range(start_at, start_at + total, per_segment))
+  stops = firsts[1:] + [None]
+  return list(zip(firsts, stops))
+
+
+def _extract_segment(video_file, base_out, interval, first, stop, scenes = None):
+  vidcap = cv2.VideoCapture(video_file)
+  writer = _FrameWriter()
+  written = 0
+  try:
+    frames = _decode(vidcap, interval, first, stop)
+    if scenes:
+      frames = _scene_changes(frames, interval, scenes)
+    for count, image in frames:
+      print(count, end=' ', flush=True)
+      writer.put(base_out + "-%04d.png" % count, image)  # save frame
+      written += 1
+  finally:
+    writer.close()
+    vidcap.release()
+  return written
+
+
+def _decode(vidcap, interval, first, stop):
+  # decodes forward and yields (count, image) for the first frame at or after each requested timestamp,
+  # instead of seeking (keyframe + decode) for every single frame
+  if first:
+    vidcap.set(cv2.CAP_PROP_POS_MSEC, first * interval)
+  count = first
+  while stop is None or count < stop:
+    if not vidcap.grab():
+      break
+    position = vidcap.get(cv2.CAP_PROP_POS_MSEC)
+    if position < count * interval:
+      continue  # grab() without retrieve() skips the colour conversion for frames we don't keep
+    success, image = vidcap.retrieve()
     if not success:
       break
-    print(count, end=' ', flush=True)
-    # print('Read frame #', count, ' at ', vidcap.get(cv2.CAP_PROP_POS_MSEC))
-    cv2.imwrite(base_out + "-%04d.png" % count, image)  # save frame
-    count = count + 1
-  print('\ncompleted')
-  return output_dir
+    # intervals shorter than a frame reuse the same image, like repeated seeks would
+    while position >= count * interval and (stop is None or count < stop):
+      yield count, image
+      count = count + 1
+
+
+def _thumbnail(image):
+  gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+  return cv2.resize(gray, scene_thumbnail, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def scene_score(thumbnail, previous) -> float:
+  return float(np.mean(np.abs(thumbnail - previous))) / 255.0
+
+
+def _scene_changes(frames, interval, scenes: SceneSampling):
+  # filters _decode's (count, image) down to the frames that start a new scene
+  kept_at, kept = None, None
+  for count, image in frames:
+    thumbnail = _thumbnail(image)
+    since = None if kept_at is None else (count - kept_at) * interval
+    if since is None or since >= scenes.max_spacing_ms or \
+        (since >= scenes.min_spacing_ms and scene_score(thumbnail, kept) >= scenes.threshold):
+      kept_at, kept = count, thumbnail
+      yield count, image
+
+
+# the frames as (timestamp in ms, png bytes) straight from the decoder, for analyzing a new video without
+# writing and re-reading every png. with pathOut the same bytes are also written to frame_path(...)
+def iter_frames(video_file, interval, start_at = 0, pathOut = None, scenes: Optional[SceneSampling] = None):
+  vidcap = cv2.VideoCapture(video_file)
+  assert vidcap.isOpened(), video_file
+  if pathOut:
+    os.makedirs(frames_directory(video_file, pathOut, interval, scenes), exist_ok=True)
+  try:
+    frames = _decode(vidcap, interval, start_at, None)
+    if scenes:
+      frames = _scene_changes(frames, interval, scenes)
+    for count, image in frames:
+      success, encoded = cv2.imencode('.png', image)  # same bytes (and sha256) as cv2.imwrite
+      assert success, (video_file, count)
+      data = encoded.tobytes()
+      if pathOut:
+        with open(frame_path(video_file, pathOut, interval, count * interval, scenes), 'wb') as out:
+          out.write(data)
+      yield count * interval, data
+  finally:
+    vidcap.release()
+
+
+# where extractImages puts the frames of video_file, e.g. easy/video or easy/video@500
+def frames_directory(video_file, pathOut, interval, scenes = None):
+  just_name = os.path.splitext(os.path.basename(video_file))[0]
+  directory = pathOut + '/' + just_name
+  if interval != 1000:
+    directory = directory + '@' + str(interval)
+  if scenes:
+    directory = directory + '@scenes'
+  return directory.replace('\\', '/')
+
+
+def frame_path(video_file, pathOut, interval, timestamp, scenes = None):
+  just_name = os.path.splitext(os.path.basename(video_file))[0]
+  return frames_directory(video_file, pathOut, interval, scenes) + '/' + just_name + "-%04d.png" % (timestamp // interval)
+
+
+class _FrameWriter:
+  # png encoding + disk writes happen on a background thread so they overlap with decoding
+  def __init__(self, max_pending=16):
+    self._pending = queue.Queue(max_pending)
+    self._failed = []
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  def put(self, filename, image):
+    self._pending.put((filename, image))
+
+  def close(self):
+    self._pending.put(None)
+    self._thread.join()
+    assert not self._failed, ('could not write', self._failed)
+
+  def _run(self):
+    while True:
+      item = self._pending.get()
+      if item is None:
+        return
+      filename, image = item
+      if not cv2.imwrite(filename, image):
+        self._failed.append(filename)
 
 
 if __name__ == "__main__":
@@ -41,6 +212,12 @@ if __name__ == "__main__":
   a.add_argument("--video_file", help="path to video", default="example/video.mp4")
   a.add_argument("--output_path", help="path for image directory (example -> example/video/video-0000.png)", default='example')
   a.add_argument('--interval', help='interval in milliseconds', default=1000, type=int)
+  a.add_argument('--workers', help='processes used for long videos (default: cpu count)', default=None, type=int)
+  a.add_argument('--scenes', action='store_true', help='only keep frames at scene changes, scored every --interval ms')
+  a.add_argument('--min_spacing', help='scene mode: minimum milliseconds between frames', default=1000, type=int)
+  a.add_argument('--max_spacing', help='scene mode: maximum milliseconds between frames', default=8000, type=int)
+  a.add_argument('--threshold', help='scene mode: difference (0-1) that counts as a new scene', default=0.08, type=float)
   args = a.parse_args()
   print(args)
-  extractImages(args.video_file, args.output_path, args.interval)
+  scenes = SceneSampling(args.min_spacing, args.max_spacing, args.threshold) if args.scenes else None
+  extractImages(args.video_file, args.output_path, args.interval, workers=args.workers, scenes=scenes)
@@ -0,0 +1,73 @@
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+# Azure's detected objects come with a parent chain (electric guitar -> guitar -> string instrument -> ...),
+# which the reducer uses to drop the generic terms. edges are learned as analyses arrive and appended to a json-lines
+# journal, and the full ancestor chain of every term is precomputed so get_generic_terms_for is one dict lookup.
+
+
+def extract_parent_path(o) -> List[str]:
+  path = []
+  while o:
+    path.append(o.object_property.lower())
+    o = o.parent
+  return path
+
+
+class Hierarchy:
+  def __init__(self, journal_file: Optional[str]):
+    # journal_file None keeps the hierarchy in memory only
+    self.journal_file = journal_file
+    self.to_generic: Dict[str, str] = {}
+    self._ancestors: Dict[str, Tuple[str, ...]] = {}
+    self.exists = journal_file is not None and os.path.isfile(journal_file)
+    if self.exists:
+      with open(journal_file, 'rt', encoding='utf-8') as source:
+        for line in source:
+          try:
+            child, parent = json.loads(line)
+          except ValueError:
+            continue  # torn last line from a crash
+          self.to_generic[child] = parent
+    self._rebuild()
+
+  def _rebuild(self):
+    self._ancestors = {}
+    for term in self.to_generic:
+      chain = []
+      p = self.to_generic.get(term)
+      while p is not None:
+        assert p not in chain and p != term, ('cycle', term, chain)
+        chain.append(p)
+        p = self.to_generic.get(p)
+      self._ancestors[term] = tuple(chain)
+
+  def add_analysis(self, d) -> int:
+    # d is an ImageAnalysis, returns the number of new (child -> parent) edges
+    new = []
+    for o in d.objects or []:
+      if not o.parent:
+        continue
+      p = extract_parent_path(o)
+      for child, parent in zip(p, p[1:]):
+        known = self.to_generic.get(child)
+        if known is None:
+          self.to_generic[child] = parent
+          new.append((child, parent))
+        else:
+          assert known == parent, (child, parent, known)
+    if new:
+      logger.info('new hierarchy terms: {}', new)
+      if self.journal_file is not None:
+        with open(self.journal_file, 'at', encoding='utf-8') as out:
+          for edge in new:
+            out.write(json.dumps(edge) + '\n')
+        self.exists = True
+      self._rebuild()
+    return len(new)
+
+  def get_generic_terms_for(self, word: str) -> List[str]:
+    return list(self._ancestors.get(word, ()))
@@ -0,0 +1,125 @@
+import heapq
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# a persistent queue of frames to analyze, for bulk downloads that run for days. every change is appended to a
+# json-lines journal as it happens, so a crash or restart resumes where it stopped instead of rescanning:
+#   ["job", path, priority, version]   queued, lower priorities first, then in the order they were queued
+#   ["done", path]                     analyzed (or covered by a near-duplicate's analysis)
+# version is the file's [size, mtime_ns] when it was queued: a frame that is regenerated in place (same name, new
+# content) has a new version and is queued again, even if it was done.
+
+
+# progressive refinement within each video: every 8th frame first, then every 4th, every 2nd and the rest
+def refinement_priority(index: int, divisors: Tuple[int, ...] = (8, 4, 2, 1)) -> int:
+  for priority, divisor in enumerate(divisors):
+    if index % divisor == 0:
+      return priority
+  return len(divisors)
+
+
+class JobQueue:
+  def __init__(self, journal_file: str):
+    self.journal_file = journal_file
+    self._priority: Dict[str, Tuple[int, int]] = {}  # path -> (priority, sequence)
+    self._version: Dict[str, Optional[list]] = {}
+    self._done: Set[str] = set()
+    self._heap: List[Tuple[int, int, str]] = []
+    self._sequence = 0
+    lines = 0
+    if os.path.isfile(journal_file):
+      with open(journal_file, 'rt', encoding='utf-8') as source:
+        for line in source:
+          try:
+            record = json.loads(line)
+          except ValueError:
+            continue  # torn last line from a crash
+          lines += 1
+          self._apply(record)
+    self._heap = [(p, s, path) for path, (p, s) in self._priority.items() if path not in self._done]
+    heapq.heapify(self._heap)
+    self._out = open(journal_file, 'at', encoding='utf-8')
+    if lines > 2 * len(self._priority) + 1000:
+      self._compact()
+
+  def _apply(self, record: list):
+    kind = record[0]
+    if kind == 'job':
+      self._queue(record[1], record[2], record[3] if len(record) > 3 else None)
+    elif kind == 'done':
+      self._done.add(record[1])
+    # older journals also have ["dir", path, mtime_ns] records, which are ignored
+
+  def _queue(self, path: str, priority: int, version: Optional[list]) -> bool:
+    if path in self._priority and self._version[path] == version:
+      return False
+    self._priority[path] = (priority, self._sequence)
+    self._sequence += 1
+    self._version[path] = version
+    self._done.discard(path)
+    return True
+
+  def _write(self, records: Iterable[list]):
+    self._out.writelines(json.dumps(r) + '\n' for r in records)
+    self._out.flush()
+
+  def _compact(self):
+    self._out.close()
+    tmp = self.journal_file + '.tmp'
+    with open(tmp, 'wt', encoding='utf-8') as out:
+      for path, (priority, _) in sorted(self._priority.items(), key=lambda item: item[1][1]):
+        out.write(json.dumps(['job', path, priority, self._version[path]]) + '\n')
+        if path in self._done:
+          out.write(json.dumps(['done', path]) + '\n')
+    os.replace(tmp, self.journal_file)
+    self._out = open(self.journal_file, 'at', encoding='utf-8')
+
+  def __len__(self):
+    # queue depth, including jobs that were taken but aren't done yet
+    return len(self._priority) - len(self._done)
+
+  def __contains__(self, path: str) -> bool:
+    return path in self._priority
+
+  def depth_by_priority(self) -> Dict[int, int]:
+    depth: Dict[int, int] = {}
+    for path, (priority, _) in self._priority.items():
+      if path not in self._done:
+        depth[priority] = depth.get(priority, 0) + 1
+    return depth
+
+  def add(self, jobs: Iterable[Tuple[str, int, list]]) -> int:
+    # (path, priority, version), paths that were already queued with the same version are ignored.
+    # returns the number of new jobs
+    new = []
+    for path, priority, version in jobs:
+      if self._queue(path, priority, version):
+        heapq.heappush(self._heap, (priority, self._priority[path][1], path))
+        new.append(['job', path, priority, version])
+    self._write(new)
+    return len(new)
+
+  def take(self, count: int) -> List[str]:
+    # the next jobs in priority order. they only count as finished once done() is called for them,
+    # so jobs that were taken but not done are queued again when the journal is reloaded
+    taken = []
+    while self._heap and len(taken) < count:
+      _, sequence, path = heapq.heappop(self._heap)
+      # entries of paths that were queued again since are stale
+      if path not in self._done and self._priority[path][1] == sequence:
+        taken.append(path)
+    return taken
+
+  def done(self, paths: Iterable[str]):
+    # the checkpoint, written right away
+    new = [p for p in paths if p in self._priority and p not in self._done]
+    self._done.update(new)
+    self._write(['done', p] for p in new)
+
+  def eta(self, calls_per_second: float) -> float:
+    # seconds until the queue is empty if every job costs one call at the rate limit (near-duplicates cost none)
+    return len(self) / calls_per_second if calls_per_second > 0 else float('inf')
+
+  def close(self):
+    self._out.close()
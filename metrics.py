@@ -0,0 +1,175 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterator, Optional
+
+# where a build spends its time: seconds + calls per stage (hashing, Azure calls, rate limit sleeps, the reducer, ...)
+# and event counters (cache hits and misses), for the whole book and for each chapter. the report says whether a slow
+# build is waiting on the disk, the CPU or the Azure quota:
+#   metrics.write_json('metrics.json')          # {'book': {...}, 'chapters': {chapter: {...}}}
+#   metrics.write_prometheus('metrics.prom')    # for node_exporter's textfile collector
+
+prometheus_prefix = 'nanogenmo'
+
+
+class Metrics:
+  def __init__(self):
+    self.seconds: Dict[str, float] = defaultdict(float)
+    self.calls: Counter = Counter()
+    self.events: Counter = Counter()
+
+  def add(self, other: dict):
+    for name, value in other['seconds'].items():
+      self.seconds[name] += value
+    self.calls.update(other['calls'])
+    self.events.update(other['events'])
+
+  def as_dict(self) -> dict:
+    return {'seconds': {k: round(v, 6) for k, v in sorted(self.seconds.items())},
+            'calls': dict(sorted(self.calls.items())), 'events': dict(sorted(self.events.items()))}
+
+
+_lock = threading.Lock()
+book = Metrics()
+chapters: Dict[str, dict] = {}
+_chapter: Optional[str] = None
+_current = Metrics()
+
+
+def add_seconds(name: str, seconds: float, calls: int = 1):
+  with _lock:
+    for m in (book, _current):
+      m.seconds[name] += seconds
+      m.calls[name] += calls
+
+
+def count(name: str, n: int = 1):
+  with _lock:
+    book.events[name] += n
+    _current.events[name] += n
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    add_seconds(name, time.perf_counter() - start)
+
+
+def timed(name: str):
+  def decorator(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      start = time.perf_counter()
+      try:
+        return func(*args, **kwargs)
+      finally:
+        add_seconds(name, time.perf_counter() - start)
+    return wrapper
+  return decorator
+
+
+# everything recorded until end_chapter() also counts for this chapter
+def begin_chapter(name: str):
+  global _chapter, _current
+  with _lock:
+    _chapter, _current = name, Metrics()
+
+
+def end_chapter() -> dict:
+  global _chapter, _current
+  with _lock:
+    snapshot = _current.as_dict()
+    if _chapter is not None:
+      chapters[_chapter] = snapshot
+    _chapter, _current = None, Metrics()
+  return snapshot
+
+
+# a chapter that was built in another process, snapshot is its end_chapter()
+def add_chapter(name: str, snapshot: dict):
+  with _lock:
+    chapters[name] = snapshot
+    book.add(snapshot)
+
+
+def reset():
+  global book, _chapter, _current
+  with _lock:
+    book, _chapter, _current = Metrics(), None, Metrics()
+    chapters.clear()
+
+
+def report() -> dict:
+  with _lock:
+    return {'book': book.as_dict(), 'chapters': dict(chapters)}
+
+
+def write_json(path: str):
+  with open(path, 'wt', encoding='utf-8') as out:
+    json.dump(report(), out, indent=2)
+
+
+def _label(value: str) -> str:
+  return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def write_prometheus(path: str):
+  r = report()
+  series = [('stage_seconds_total', 'seconds', 'stage', 'seconds spent per stage'),
+            ('stage_calls_total', 'calls', 'stage', 'calls per stage'),
+            ('events_total', 'events', 'event', 'cache hits, misses and other events')]
+  lines = []
+  for metric, key, label, help_text in series:
+    # separate book and chapter metrics, so summing over chapters doesn't count everything twice
+    name = prometheus_prefix + '_book_' + metric
+    lines.append('# HELP %s %s' % (name, help_text))
+    lines.append('# TYPE %s counter' % name)
+    for k, v in r['book'][key].items():
+      lines.append('%s{%s="%s"} %s' % (name, label, _label(k), v))
+    name = prometheus_prefix + '_chapter_' + metric
+    lines.append('# HELP %s %s, per chapter' % (name, help_text))
+    lines.append('# TYPE %s counter' % name)
+    for chapter, values in r['chapters'].items():
+      for k, v in values[key].items():
+        lines.append('%s{chapter="%s",%s="%s"} %s' % (name, _label(chapter), label, _label(k), v))
+  # written next to the final name and renamed, so the collector never reads half a file
+  with open(path + '.tmp', 'wt', encoding='utf-8') as out:
+    out.write('\n'.join(lines) + '\n')
+  os.replace(path + '.tmp', path)
+
+
+# opt-in profiling of a whole build: 'cprofile' dumps pstats to output, 'tracemalloc' writes the top allocation sites
+@contextlib.contextmanager
+def profiling(mode: Optional[str], output: str, top: int = 50) -> Iterator[None]:
+  assert mode in (None, 'cprofile', 'tracemalloc'), mode
+  if mode is None:
+    yield
+  elif mode == 'cprofile':
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+      yield
+    finally:
+      profiler.disable()
+      profiler.dump_stats(output)
+  else:
+    import tracemalloc
+    tracemalloc.start()
+    try:
+      yield
+    finally:
+      snapshot = tracemalloc.take_snapshot()
+      _, peak = tracemalloc.get_traced_memory()
+      tracemalloc.stop()
+      with open(output, 'wt', encoding='utf-8') as out:
+        out.write('peak: %.1f MiB\n' % (peak / 2 ** 20))
+        for s in snapshot.statistics('lineno')[:top]:
+          out.write(str(s) + '\n')
@@ -0,0 +1,96 @@
+import hashlib
+import os
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from loguru import logger
+
+# converting the whole book from markdown to LaTeX every time is wasted work when one chapter changed. instead every
+# chapter (a level 1 heading up to the next one) is converted on its own and kept as a LaTeX fragment, named by the
+# hash of its markdown, and the document that's typeset is the fragments as raw LaTeX blocks. the headings are still
+# \section's in one document, so LaTeX numbers them and builds the table of contents as before.
+# what's saved is pandoc's markdown conversion, LaTeX still typesets the whole book.
+# two things the writer would otherwise do for the whole document: every fragment gets its own --id-prefix, so
+# chapters with the same title don't repeat a \label, and the template variables that load packages for what the
+# writer saw (e.g. strikeout for \sout) are set from the fragments, see template_args.
+
+# passed to every fragment conversion, and part of the fragment names
+fragment_args = ['-f', 'markdown', '-t', 'latex', '-N']
+
+
+def split_chapters(text: str) -> List[str]:
+  # text before the first heading (e.g. \pagebreak) is a fragment of its own
+  chunks = re.split(r'(?m)^(?=# )', text)
+  return [c for c in chunks if c]
+
+
+# markers the LaTeX writer leaves for the features its template only supports when they were seen in the document
+template_features = {'strikeout': '\\sout{', 'tables': '\\begin{longtable}', 'graphics': '\\includegraphics'}
+
+
+def id_prefixes(chunks: List[str]) -> List[str]:
+  # from the chunk itself, so a fragment keeps its prefix (and name) when other chapters change. repeated chunks
+  # are numbered
+  seen = {}
+  prefixes = []
+  for chunk in chunks:
+    h = hashlib.sha256(chunk.encode('utf-8')).hexdigest()[:12]
+    seen[h] = seen.get(h, 0) + 1
+    prefixes.append('f%s-%d-' % (h, seen[h]))
+  return prefixes
+
+
+def fragment_name(chunk: str, pandoc_version: str, id_prefix: str = '') -> str:
+  key = '\0'.join([pandoc_version] + fragment_args + [id_prefix, chunk])
+  return hashlib.sha256(key.encode('utf-8')).hexdigest() + '.tex'
+
+
+def _pandoc_version() -> str:
+  result = subprocess.run(['pandoc', '--version'], check=True, capture_output=True, text=True)
+  return result.stdout.splitlines()[0]
+
+
+def _render(chunk: str, path: str, id_prefix: str):
+  subprocess.run(['pandoc'] + fragment_args + ['--id-prefix', id_prefix, '-o', path + '.tmp'],
+                 input=chunk.encode('utf-8'), check=True)
+  os.replace(path + '.tmp', path)
+
+
+def _raw_latex(fragment: str) -> str:
+  # a fence longer than any run of backticks in the fragment
+  longest = max((len(m) for m in re.findall('`+', fragment)), default=0)
+  fence = '`' * max(3, longest + 1)
+  return fence + '{=latex}\n' + fragment.rstrip('\n') + '\n' + fence + '\n'
+
+
+# converts the chapters of markdown_file whose fragments are missing from fragment_dir, workers at a time, and
+# writes the document made of all the fragments. returns its filename, for pandoc instead of markdown_file
+def assemble(markdown_file: str, fragment_dir: str, workers: Optional[int] = None) -> str:
+  os.makedirs(fragment_dir, exist_ok=True)
+  with open(markdown_file, 'rt', encoding='utf-8') as f:
+    chunks = split_chapters(f.read())
+  version = _pandoc_version()
+  prefixes = id_prefixes(chunks)
+  paths = [os.path.join(fragment_dir, fragment_name(c, version, p)) for c, p in zip(chunks, prefixes)]
+  stale = {path: (c, p) for path, c, p in zip(paths, chunks, prefixes) if not os.path.isfile(path)}
+  logger.info('{}: {} of {} fragments to convert', markdown_file, len(stale), len(chunks))
+  if stale:
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+      # pandoc runs in its own process, threads are enough to keep several of them busy
+      for _ in pool.map(_render, [c for c, _ in stale.values()], stale.keys(), [p for _, p in stale.values()]):
+        pass
+  document = os.path.join(fragment_dir, os.path.splitext(os.path.basename(markdown_file))[0] + '.md')
+  with open(document, 'wt', encoding='utf-8') as out:
+    for path in paths:
+      with open(path, 'rt', encoding='utf-8') as f:
+        out.write(_raw_latex(f.read()) + '\n')
+  return document
+
+
+# the -V arguments for the pandoc run that typesets document (see assemble)
+def template_args(document: str) -> List[str]:
+  with open(document, 'rt', encoding='utf-8') as f:
+    text = f.read()
+  return [arg for name, marker in template_features.items() if marker in text for arg in ('-V', name)]
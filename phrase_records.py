@@ -0,0 +1,53 @@
+from typing import Dict, Iterator, List, Optional
+
+# what extract_phrases finds in an analysis. many thousands of these are made per chapter, hence __slots__
+sources = ('caption', 'celebrity', 'tag', 'object')
+
+
+class Phrase:
+  __slots__ = ('text', 'source', 'confidence', 'box')
+
+  def __init__(self, text: str, source: str, confidence: Optional[float] = None, box: Optional[int] = None):
+    self.text = text
+    self.source = source
+    # None where Azure doesn't give one (the description's tags)
+    self.confidence = confidence
+    # index into the analysis' objects for the phrases that come from one
+    self.box = box
+
+  def __repr__(self):
+    return 'Phrase(%r, %r, %r, %r)' % (self.text, self.source, self.confidence, self.box)
+
+  def __eq__(self, other):
+    return isinstance(other, Phrase) and (self.text, self.source, self.confidence, self.box) == \
+           (other.text, other.source, other.confidence, other.box)
+
+
+# phrases in the order they were first found, a text that's already there is ignored (the first source wins)
+class PhraseSet:
+  __slots__ = ('_phrases',)
+
+  def __init__(self):
+    self._phrases: Dict[str, Phrase] = {}
+
+  def add(self, text: str, source: str, confidence: Optional[float] = None, box: Optional[int] = None) -> bool:
+    if text in self._phrases:
+      return False
+    self._phrases[text] = Phrase(text, source, confidence, box)
+    return True
+
+  def __contains__(self, text: str) -> bool:
+    return text in self._phrases
+
+  def __len__(self):
+    return len(self._phrases)
+
+  def __iter__(self) -> Iterator[Phrase]:
+    return iter(self._phrases.values())
+
+  def get(self, text: str) -> Optional[Phrase]:
+    return self._phrases.get(text)
+
+  def texts(self) -> List[str]:
+    # the plain strings, as extract_text returns them
+    return list(self._phrases)
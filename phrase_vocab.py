@@ -0,0 +1,225 @@
+import argparse
+import array
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# every phrase gets an integer id, kept across runs in a json-lines file (line number = id), and the corpus statistics
+# are numpy arrays indexed by those ids instead of Counters keyed by the phrase strings:
+#   per chapter, the phrases of every frame as one id array + frame offsets (like a sparse matrix's rows), which grow
+#   frame by frame while the chapter is built (ChapterBuilder)
+#   per chapter, counts = bincount of those ids, first frame each phrase appears in
+# so most_common, which chapters share phrases and first appearances are array operations over the whole book.
+# Corpus.save/load keeps a build's statistics around for queries afterwards:
+#   python phrase_vocab.py --chapter bad-apple        # most common phrases of a chapter
+#   python phrase_vocab.py --shared                   # how many phrases each pair of chapters has in common
+
+
+class Vocabulary:
+  def __init__(self, path: Optional[str] = None):
+    # path None keeps the vocabulary in memory only
+    self.path = path
+    self._ids: Dict[str, int] = {}
+    self._texts: List[str] = []
+    self._unsaved = 0
+    if path and os.path.isfile(path):
+      good = 0
+      with open(path, 'rb') as source:
+        for line in source:
+          try:
+            text = json.loads(line.decode('utf-8'))
+          except ValueError:
+            break  # torn last line from a crash
+          if not line.endswith(b'\n'):
+            break
+          good += len(line)
+          self._ids[text] = len(self._texts)
+          self._texts.append(text)
+      if good != os.path.getsize(path):
+        with open(path, 'r+b') as f:
+          f.truncate(good)
+
+  def __len__(self):
+    return len(self._texts)
+
+  def __contains__(self, text: str) -> bool:
+    return text in self._ids
+
+  def intern(self, texts: Iterable[str]) -> List[int]:
+    ids = []
+    for text in texts:
+      i = self._ids.get(text)
+      if i is None:
+        i = self._ids[text] = len(self._texts)
+        self._texts.append(text)
+        self._unsaved += 1
+      ids.append(i)
+    return ids
+
+  def id_of(self, text: str) -> Optional[int]:
+    return self._ids.get(text)
+
+  def text(self, i: int) -> str:
+    return self._texts[i]
+
+  def texts(self, ids: Iterable[int]) -> List[str]:
+    return [self._texts[i] for i in ids]
+
+  def save(self):
+    # appends the phrases that are new since the last save
+    if not self.path or not self._unsaved:
+      return
+    os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+    with open(self.path, 'at', encoding='utf-8') as out:
+      for text in self._texts[len(self._texts) - self._unsaved:]:
+        out.write(json.dumps(text) + '\n')
+    self._unsaved = 0
+
+
+class ChapterStats:
+  __slots__ = ('ids', 'offsets')
+
+  def __init__(self, ids: np.ndarray, offsets: np.ndarray):
+    # the phrase ids of frame i are ids[offsets[i]:offsets[i + 1]]
+    self.ids = ids
+    self.offsets = offsets
+
+  def __len__(self):
+    # frames
+    return len(self.offsets) - 1
+
+  def frame(self, i: int) -> np.ndarray:
+    return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+  def counts(self, size: int) -> np.ndarray:
+    return np.bincount(self.ids, minlength=size)
+
+  def first_frames(self, size: int) -> np.ndarray:
+    # the first frame each phrase id appears in, -1 if it doesn't
+    first = np.full(size, -1, dtype=np.int64)
+    unique, positions = np.unique(self.ids, return_index=True)
+    first[unique] = np.searchsorted(self.offsets, positions, side='right') - 1
+    return first
+
+
+class ChapterBuilder:
+  def __init__(self, vocabulary: Vocabulary):
+    # every frame is interned as it's added, the chapter is never a list of phrase strings
+    self.vocabulary = vocabulary
+    self._ids = array.array('i')
+    self._offsets = array.array('q', [0])
+
+  def add_frame(self, texts: Iterable[str]):
+    self._ids.extend(self.vocabulary.intern(texts))
+    self._offsets.append(len(self._ids))
+
+  def stats(self) -> ChapterStats:
+    return ChapterStats(np.frombuffer(self._ids, dtype=np.int32).copy(),
+                        np.frombuffer(self._offsets, dtype=np.int64).copy())
+
+
+class Corpus:
+  def __init__(self, vocabulary: Vocabulary):
+    self.vocabulary = vocabulary
+    self.chapters: Dict[str, ChapterStats] = {}
+
+  def chapter_builder(self) -> ChapterBuilder:
+    return ChapterBuilder(self.vocabulary)
+
+  def add_chapter(self, name: str, frames: Iterable[Sequence[str]]):
+    builder = self.chapter_builder()
+    for f in frames:
+      builder.add_frame(f)
+    self.chapters[name] = builder.stats()
+
+  # a chapter for a corpus with another vocabulary (the parent of a worker process, the chapter cache):
+  # (its distinct phrases in the order they first appear, ids and offsets with ids indexing those phrases)
+  def portable_chapter(self, name: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    stats = self.chapters[name]
+    unique, first = np.unique(stats.ids, return_index=True)
+    unique = unique[np.argsort(first, kind='stable')]
+    local = np.zeros(int(unique.max()) + 1 if len(unique) else 0, dtype=np.int32)
+    local[unique] = np.arange(len(unique), dtype=np.int32)
+    return self.vocabulary.texts(unique), local[stats.ids], stats.offsets
+
+  def add_portable_chapter(self, name: str, texts: List[str], ids: Sequence[int], offsets: Sequence[int]):
+    # interned in the order they first appear, so the ids are the same as if the frames were added one by one
+    mapping = np.array(self.vocabulary.intern(texts), dtype=np.int32)
+    self.chapters[name] = ChapterStats(mapping[np.asarray(ids, dtype=np.int64)], np.asarray(offsets, dtype=np.int64))
+
+  def chapter_frames(self, name: str) -> List[List[str]]:
+    stats = self.chapters[name]
+    return [self.vocabulary.texts(stats.frame(i)) for i in range(len(stats))]
+
+  def counts(self, chapter: Optional[str] = None) -> np.ndarray:
+    size = len(self.vocabulary)
+    if chapter is not None:
+      return self.chapters[chapter].counts(size)
+    if not self.chapters:
+      return np.zeros(size, dtype=np.int64)
+    return np.bincount(np.concatenate([c.ids for c in self.chapters.values()]), minlength=size)
+
+  def most_common(self, n: int, chapter: Optional[str] = None) -> List[Tuple[str, int]]:
+    counts = self.counts(chapter)
+    # ties in id order, i.e. the order the phrases were first seen in
+    top = np.argsort(-counts, kind='stable')[:n]
+    return [(self.vocabulary.text(i), int(counts[i])) for i in top if counts[i]]
+
+  def chapter_matrix(self) -> np.ndarray:
+    # chapters x phrases counts, rows in the order the chapters were added
+    size = len(self.vocabulary)
+    return np.stack([c.counts(size) for c in self.chapters.values()]) if self.chapters else np.zeros((0, size))
+
+  def shared_phrases(self) -> np.ndarray:
+    # chapters x chapters, the number of distinct phrases both chapters have
+    present = (self.chapter_matrix() > 0).astype(np.int32)
+    return present @ present.T
+
+  def chapters_with(self, text: str) -> List[str]:
+    i = self.vocabulary.id_of(text)
+    if i is None:
+      return []
+    return [name for name, stats in self.chapters.items() if np.any(stats.ids == i)]
+
+  def first_appearance(self, chapter: str) -> List[str]:
+    # the chapter's phrases in the order they first appear
+    first = self.chapters[chapter].first_frames(len(self.vocabulary))
+    present = np.flatnonzero(first >= 0)
+    return self.vocabulary.texts(present[np.argsort(first[present], kind='stable')])
+
+  def save(self, path: str):
+    self.vocabulary.save()
+    names = list(self.chapters)
+    arrays = {}
+    for i, name in enumerate(names):
+      arrays['ids_%d' % i] = self.chapters[name].ids
+      arrays['offsets_%d' % i] = self.chapters[name].offsets
+    np.savez_compressed(path, names=np.array(names, dtype=object), **arrays)
+
+  @classmethod
+  def load(cls, path: str, vocabulary: Vocabulary) -> 'Corpus':
+    corpus = cls(vocabulary)
+    with np.load(path, allow_pickle=True) as data:
+      for i, name in enumerate(data['names']):
+        corpus.chapters[str(name)] = ChapterStats(data['ids_%d' % i], data['offsets_%d' % i])
+    return corpus
+
+
+if __name__ == "__main__":
+  a = argparse.ArgumentParser()
+  a.add_argument('--corpus', default='.cache/corpus.npz')
+  a.add_argument('--vocabulary', default='.cache/phrases.jsonl')
+  a.add_argument('--chapter', help='only this chapter')
+  a.add_argument('-n', default=20, type=int)
+  a.add_argument('--shared', action='store_true', help='phrases shared between chapters')
+  args = a.parse_args()
+  c = Corpus.load(args.corpus, Vocabulary(args.vocabulary))
+  if args.shared:
+    names = list(c.chapters)
+    for name, row in zip(names, c.shared_phrases()):
+      print(name, ' '.join('%s=%d' % (other, n) for other, n in zip(names, row) if other != name and n))
+  else:
+    for text, count in c.most_common(args.n, args.chapter):
+      print('%6d  %s' % (count, text))
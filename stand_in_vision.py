@@ -0,0 +1,85 @@
+import argparse
+import json
+import math
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import vision_pipeline
+
+# a local stand-in for the Azure Computer Vision analyze endpoint, so the concurrent pipeline's throughput and
+# 429 handling can be measured offline. it enforces a tier profile the same way Azure does (429 + Retry-After):
+#   python stand_in_vision.py --port 8765 --tier S1 --latency 0.3
+# then cloud_vision.connect('http://127.0.0.1:8765/', 'any key')
+
+default_response = {
+  'categories': [],
+  'adult': {'isAdultContent': False, 'isRacyContent': False, 'isGoryContent': False,
+            'adultScore': 0.0, 'racyScore': 0.0, 'goreScore': 0.0},
+  'tags': [{'name': 'text', 'confidence': 0.9}],
+  'description': {'tags': ['text'], 'captions': [{'text': 'a stand-in caption', 'confidence': 0.5}]},
+  'faces': [],
+  'objects': [],
+  'brands': [],
+  'metadata': {'height': 480, 'width': 640, 'format': 'Png'},
+  'modelVersion': 'stand-in',
+}
+
+
+def serve(port: int = 0, tier: str = 'S1', latency: float = 0.3, response: Optional[dict] = None) -> ThreadingHTTPServer:
+  bucket = vision_pipeline.TokenBucket(vision_pipeline.tier_profiles[tier])
+  body = dict(response or default_response)
+
+  class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+      self.rfile.read(int(self.headers.get('Content-Length', 0)))
+      server.requests += 1
+      wait = bucket.try_acquire()
+      if wait:
+        server.throttled += 1
+        self._reply(429, {'error': {'code': '429', 'message': 'Rate limit is exceeded.'}},
+                    {'Retry-After': str(math.ceil(wait))})
+        return
+      time.sleep(latency)
+      self._reply(200, dict(body, requestId=str(uuid.uuid4())))
+
+    def _reply(self, status, payload, headers=None):
+      data = json.dumps(payload).encode('utf-8')
+      self.send_response(status)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(data)))
+      for k, v in (headers or {}).items():
+        self.send_header(k, v)
+      self.end_headers()
+      self.wfile.write(data)
+
+    def log_message(self, *args):
+      pass
+
+  server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+  server.requests = 0
+  server.throttled = 0
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return server
+
+
+def endpoint_for(server: ThreadingHTTPServer) -> str:
+  return 'http://%s:%d/' % server.server_address[:2]
+
+
+if __name__ == "__main__":
+  a = argparse.ArgumentParser()
+  a.add_argument('--port', default=8765, type=int)
+  a.add_argument('--tier', default='S1', choices=sorted(vision_pipeline.tier_profiles))
+  a.add_argument('--latency', help='seconds per request', default=0.3, type=float)
+  args = a.parse_args()
+  s = serve(args.port, args.tier, args.latency)
+  print('serving on', endpoint_for(s))
+  try:
+    while True:
+      time.sleep(10)
+      print(s.requests, 'requests,', s.throttled, 'throttled')
+  except KeyboardInterrupt:
+    s.shutdown()
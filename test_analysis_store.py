@@ -0,0 +1,68 @@
+import os
+import pickle
+
+import pytest
+
+from analysis_store import AnalysisStore
+
+hash_a = 'a' * 64
+hash_b = 'b' * 64
+
+
+def test_round_trip(tmp_path):
+  store = AnalysisStore(str(tmp_path / 'analyses'))
+  store.put(hash_a, {'description': 'first'})
+  store.put(hash_b, ['second'])
+  assert hash_a in store
+  assert store.get(hash_b) == ['second']
+  assert store.get('c' * 64) is None
+  store.close()
+
+  reopened = AnalysisStore(str(tmp_path / 'analyses'))
+  assert len(reopened) == 2
+  assert reopened.get_many([hash_b, hash_a, 'c' * 64]) == {hash_a: {'description': 'first'}, hash_b: ['second']}
+
+
+def test_torn_index_record(tmp_path):
+  store = AnalysisStore(str(tmp_path / 'analyses'))
+  store.put(hash_a, 1)
+  store.close()
+  with open(store.index_file, 'ab') as index:
+    index.write(b'partial')
+
+  reopened = AnalysisStore(str(tmp_path / 'analyses'))
+  assert reopened.get(hash_a) == 1
+  reopened.put(hash_b, 2)
+  assert AnalysisStore(str(tmp_path / 'analyses')).get(hash_b) == 2
+
+
+def test_index_records_past_the_pack(tmp_path):
+  # the index reached the disk but the pack didn't
+  store = AnalysisStore(str(tmp_path / 'analyses'))
+  store.put(hash_a, 1)
+  store.put(hash_b, 2)
+  store.close()
+  with open(store.pack_file, 'r+b') as pack:
+    pack.truncate(store._index[hash_b][0])
+
+  reopened = AnalysisStore(str(tmp_path / 'analyses'))
+  assert reopened.get(hash_a) == 1 and hash_b not in reopened
+  reopened.put(hash_b, 3)
+  reopened.close()
+  assert AnalysisStore(str(tmp_path / 'analyses')).get(hash_b) == 3
+
+
+def test_migrate_pickles(tmp_path):
+  with open(os.path.join(tmp_path, hash_a + '.pkl'), 'wb') as output:
+    pickle.dump({'tags': ['dog']}, output)
+  with open(os.path.join(tmp_path, '_get_file_hash.json'), 'wt') as output:
+    output.write('{}')
+
+  store = AnalysisStore(str(tmp_path / 'analyses'))
+  assert store.migrate_pickles(str(tmp_path)) == 1
+  assert store.migrate_pickles(str(tmp_path)) == 0
+  assert store.get(hash_a) == {'tags': ['dog']}
+
+
+if __name__ == '__main__':
+  pytest.main()
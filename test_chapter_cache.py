@@ -0,0 +1,28 @@
+import pytest
+
+from chapter_cache import ChapterCache, chapter_key
+
+
+def test_lines_come_from_the_part_file(tmp_path):
+  cache = ChapterCache(str(tmp_path / 'chapters'))
+  part = str(tmp_path / 'chapter.md')
+  lines = ['# Chapter', 'Dog. Snow.', '', 'Cat.']
+  with open(part, 'wt', encoding='utf-8') as out:
+    out.write(''.join(line + '\n\n' for line in lines))
+  key = chapter_key({'frames': ['abc'], 'window': 4})
+  assert key == chapter_key({'window': 4, 'frames': ['abc']})
+  assert cache.get(key, part) is None
+
+  cache.put(key, part, len(lines), {'celebs': ['Madonna']})
+  cached_lines, summary = cache.get(key, part)
+  assert cached_lines == lines
+  assert summary['celebs'] == ['Madonna'] and summary['lines'] == 4
+
+  # overwritten by another run
+  with open(part, 'wt', encoding='utf-8') as out:
+    out.write('# Chapter\n\n')
+  assert cache.get(key, part) is None
+
+
+if __name__ == '__main__':
+  pytest.main()
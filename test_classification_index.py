@@ -0,0 +1,41 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from classification_index import ClassificationIndex, record_for
+
+
+def _adult(racy=False, gory=False):
+  return SimpleNamespace(is_adult_content=False, is_racy_content=racy, is_gory_content=gory,
+                         adult_score=0.01, racy_score=0.9 if racy else 0.1, gore_score=0.5 if gory else 0.0)
+
+
+def test_index_and_links(tmp_path):
+  frames = tmp_path / 'easy' / 'video'
+  frames.mkdir(parents=True)
+  for name in ['video-0001.png', 'video-0002.png']:
+    (frames / name).write_bytes(b'png')
+  journal = str(tmp_path / 'class' / 'classification.jsonl')
+  os.makedirs(os.path.dirname(journal))
+
+  index = ClassificationIndex(journal)
+  assert index.add(record_for(str(frames / 'video-0001.png'), 'a' * 64, _adult(racy=True)))
+  assert index.add(record_for(str(frames / 'video-0002.png'), 'b' * 64, _adult()))
+  assert not index.add(record_for(str(frames / 'video-0001.png'), 'a' * 64, _adult(racy=True)))
+
+  racy = tmp_path / 'class' / 'racy' / 'video-0001.png'
+  assert racy.exists() and os.path.samefile(str(racy), str(frames / 'video-0001.png'))
+  assert not (tmp_path / 'class' / 'gory').exists()
+
+  reloaded = ClassificationIndex(journal, links=None)
+  assert len(reloaded) == 2
+  assert [r['hash'] for r in reloaded.frames('racy', chapter='video')] == ['a' * 64]
+  assert reloaded.frames('racy', chapter='other') == []
+  assert len(reloaded.frames(chapter='video')) == 2
+  assert reloaded.known_hash(str(frames / 'video-0002.png')) == 'b' * 64
+  assert reloaded.known_hash(str(frames / 'video-0003.png')) is None
+
+
+if __name__ == '__main__':
+  pytest.main()
@@ -0,0 +1,264 @@
+import hashlib
+import json
+import os
+import pickle
+import zipfile
+
+import pytest
+from azure.cognitiveservices.vision.computervision.models import ImageAnalysis
+
+import analysis_providers
+import analysis_store
+import cloud_vision
+import file_hashes
+import frame_dedup
+import job_queue
+import textmods
+
+
+def _forget_caches(monkeypatch):
+  for name in ['_analysis_store', '_debug_sink', '_classification_index', '_hierarchy', '_corpus', '_chapter_cache']:
+    monkeypatch.setattr(cloud_vision, name, None)
+  monkeypatch.setattr(cloud_vision, '_directories_made', False)
+  monkeypatch.setattr(cloud_vision, 'near_duplicate_distance', None)
+  monkeypatch.setattr(cloud_vision, 'debug_artifacts', 'off')
+  monkeypatch.setattr(file_hashes, '_known', None)
+  monkeypatch.setattr(frame_dedup, '_cache', None)
+  monkeypatch.setattr(frame_dedup, '_unsaved', {})
+  monkeypatch.setattr(textmods, '_appearance_lookup', {})
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+  # an empty working directory, with none of the caches of an earlier test
+  monkeypatch.chdir(tmp_path)
+  _forget_caches(monkeypatch)
+  return tmp_path
+
+
+_words = ['stage', 'concert', 'night', 'crowd', 'light', 'smoke', 'drum', 'microphone', 'singer', 'dance', 'red']
+
+
+def _response(i):
+  # every frame has an electric guitar, and 'musical instrument' is only dropped by knowing that it's more generic
+  guitar = {'object': 'Electric guitar', 'confidence': 0.8, 'rectangle': {'x': 0, 'y': 0, 'w': 9, 'h': 9},
+            'parent': {'object': 'Guitar', 'confidence': 0.9, 'parent': {'object': 'Musical instrument', 'confidence': 0.9}}}
+  return {'categories': [], 'faces': [], 'objects': [guitar],
+          'adult': {'isAdultContent': False, 'isRacyContent': False, 'isGoryContent': False,
+                    'adultScore': 0.1, 'racyScore': 0.1, 'goreScore': 0.0},
+          'tags': [{'name': 'musical instrument', 'confidence': 0.9}] +
+                  [{'name': _words[(i * 3 + k) % len(_words)], 'confidence': 0.8} for k in range(3)],
+          'description': {'tags': ['music'], 'captions': [{'text': 'a man playing a guitar', 'confidence': 0.5}]}}
+
+
+class _Sink:
+  def analysis(self, filename, response):
+    pass
+
+
+def _stream(monkeypatch, distance, dhashes):
+  analyzed = []
+
+  def analyze(f, data=None, file_hash=None):
+    analyzed.append(f)
+    return 'analysis of ' + f
+
+  monkeypatch.setattr(cloud_vision, 'near_duplicate_distance', distance)
+  monkeypatch.setattr(cloud_vision, 'analyze', analyze)
+  monkeypatch.setattr(cloud_vision, 'is_analyzed', lambda file_hash: False)
+  monkeypatch.setattr(cloud_vision, 'get_debug_sink', lambda: _Sink())
+  monkeypatch.setattr(cloud_vision.frame_dedup, 'get_dhash', lambda f, file_hash, data: dhashes[f])
+  frames = [(f, f.encode('utf-8')) for f in sorted(dhashes)]
+  return {f: d for f, file_hash, d in cloud_vision.iter_streamed_analyses(frames)}, analyzed
+
+
+def test_streamed_without_dedup_analyzes_every_frame(monkeypatch):
+  responses, analyzed = _stream(monkeypatch, None, {'a': 0, 'b': 0, 'c': 0})
+  assert analyzed == ['a', 'b', 'c']
+  assert responses == {'a': 'analysis of a', 'b': 'analysis of b', 'c': 'analysis of c'}
+
+
+def test_streamed_near_duplicates_share_an_analysis(monkeypatch):
+  # b is within 4 bits of a, c isn't, d is within 4 bits of c
+  responses, analyzed = _stream(monkeypatch, 4, {'a': 0, 'b': 0b111, 'c': 0xff00, 'd': 0xff01})
+  assert analyzed == ['a', 'c']
+  assert responses == {'a': 'analysis of a', 'b': 'analysis of a', 'c': 'analysis of c', 'd': 'analysis of c'}
+
+
+def test_streamed_frames_are_indexed_by_their_hash(workdir, monkeypatch):
+  # the frames are only in memory, the classification index gets the hashes iter_streamed_analyses computed
+  frames = [('easy/v/f-%04d.png' % i, b'frame %d' % i) for i in range(3)]
+  for i, (f, data) in enumerate(frames):
+    cloud_vision.get_analysis_store().put(hashlib.sha256(data).hexdigest(), ImageAnalysis.deserialize(_response(i)))
+
+  def get_file_hash(f):
+    raise AssertionError('hashed again: ' + f)
+
+  monkeypatch.setattr(cloud_vision.file_hashes, 'get_file_hash', get_file_hash)
+  list(cloud_vision.iter_chapter_phrases('Chapter', [], analyses=cloud_vision.iter_streamed_analyses(frames)))
+  records = cloud_vision.get_classification_index().frames(chapter='v')
+  assert [r['hash'] for r in records] == [hashlib.sha256(data).hexdigest() for f, data in frames]
+
+
+def test_replay_on_an_empty_cache_matches_the_build(workdir, monkeypatch):
+  os.makedirs('build/easy/chap')
+  os.makedirs('replay')
+  monkeypatch.chdir('build')
+  with zipfile.ZipFile(str(workdir / 'replay' / 'analyses.zip'), 'w') as zf:
+    for i in range(6):
+      with open('easy/chap/f-%04d.png' % i, 'wb') as out:
+        out.write(b'frame %d' % i)
+      cloud_vision.get_analysis_store().put(hashlib.sha256(b'frame %d' % i).hexdigest(),
+                                            ImageAnalysis.deserialize(_response(i)))
+      zf.writestr('json-analyze/chap/f-%04d.json' % i, json.dumps(_response(i)))
+  built = cloud_vision.gen_for_directory('easy/chap', 'Chapter', filename='chap.md', randomize_order=False)
+  assert 'Musical instrument.' not in ' '.join(built) and 'Electric guitar.' in ' '.join(built)
+
+  monkeypatch.chdir(workdir / 'replay')
+  _forget_caches(monkeypatch)
+  provider = analysis_providers.ZipAnalysisProvider('analyses.zip')
+  replayed = cloud_vision.gen_for_directory('easy/chap', 'Chapter', filename='chap.md', randomize_order=False,
+                                            provider=provider)
+  assert replayed == built
+  assert not os.path.exists('.cache/hierarchy.jsonl')
+
+
+def test_frames_regenerated_in_place_are_queued_again(workdir):
+  os.makedirs('easy/v')
+  for i in range(3):
+    with open('easy/v/v-%04d.png' % i, 'wb') as out:
+      out.write(b'frame %d' % i)
+  queue = job_queue.JobQueue('queue.jsonl')
+  assert cloud_vision.scan_for_frames(queue, ['easy/*/*.png']) == 3
+  queue.done(queue.take(3))
+  assert cloud_vision.scan_for_frames(queue, ['easy/*/*.png']) == 0
+
+  with open('easy/v/v-0001.png', 'wb') as out:
+    out.write(b'regenerated frame 1')
+  assert cloud_vision.scan_for_frames(queue, ['easy/*/*.png']) == 1
+  assert queue.take(3) == ['easy/v/v-0001.png']
+  queue.close()
+
+
+def test_each_frame_is_counted_once(workdir, monkeypatch):
+  # frames 1 and 2 are near-duplicates of frame 0, only frame 0 and 3 are analyzed
+  _store_chapters(['chap'], frames=4, store=False)
+  for i in (0, 3):
+    with open('easy/chap/f-%04d.png' % i, 'rb') as f:
+      cloud_vision.get_analysis_store().put(hashlib.sha256(f.read()).hexdigest(), ImageAnalysis.deserialize(_response(i)))
+  monkeypatch.setattr(cloud_vision, 'near_duplicate_distance', 4)
+  monkeypatch.setattr(cloud_vision.frame_dedup, 'collapse', lambda files, hashes, distance: {f: files[0] for f in files[1:3]})
+  cloud_vision.metrics.reset()
+  cloud_vision.gen_for_directory('easy/chap', 'Chapter', filename='chap.md', randomize_order=False)
+  book = cloud_vision.metrics.book
+  assert dict(book.events) == {'cache_hit': 2, 'near_duplicate': 2, 'reducer_repeats': 2}
+  assert book.calls['hash'] == 1
+
+
+class _Client:
+  def analyze_image_in_stream(self, image, visual_features):
+    return ImageAnalysis.deserialize(_response(len(image.read())))
+
+
+def test_upload_savings_are_in_the_metrics(workdir, monkeypatch):
+  # both the per-frame analyze() and analyze_many report what upload_payload saved
+  monkeypatch.setattr(cloud_vision, 'get_client', lambda: _Client())
+  monkeypatch.setattr(cloud_vision, 'allow_azure_calls', True)
+  monkeypatch.setattr(cloud_vision, 'upload_profile', cloud_vision.upload_payload.PayloadProfile(640, '.jpg', 80))
+  monkeypatch.setattr(cloud_vision.upload_payload, 'prepare', lambda data, profile: data[:4])
+  for name in ('a.png', 'b.png'):
+    with open(name, 'wb') as f:
+      f.write(name.encode('utf-8') * 10)
+  cloud_vision.metrics.reset()
+  cloud_vision.analyze('a.png')
+  assert cloud_vision.analyze_many(['a.png', 'b.png']) == 1
+  events = cloud_vision.metrics.book.events
+  assert events['upload_bytes_sent'] == 8
+  assert events['upload_bytes_saved'] == 2 * (50 - 4)
+
+
+def test_an_interrupted_migration_is_completed(workdir):
+  os.makedirs('.cache')
+  for i in range(3):
+    with open('.cache/%s.pkl' % hashlib.sha256(b'%d' % i).hexdigest(), 'wb') as out:
+      pickle.dump(i, out)
+  # the first run stopped after one pickle
+  store = analysis_store.AnalysisStore('.cache/analyses')
+  with open('.cache/%s.pkl' % hashlib.sha256(b'0').hexdigest(), 'rb') as f:
+    store.put_raw(hashlib.sha256(b'0').hexdigest(), f.read())
+  store.close()
+
+  assert len(cloud_vision.get_analysis_store()) == 3
+  assert os.path.isfile(cloud_vision.pickles_migrated_file)
+
+
+def _store_chapters(names, frames=20, store=True):
+  # each chapter starts at another frame of the cycle, so the phrases first appear in another order.
+  # returns {frame file: its response}, the responses are only in the analysis store if store
+  responses = {}
+  for offset, name in enumerate(names):
+    os.makedirs('easy/' + name)
+    for i in range(frames):
+      data = b'%s frame %d' % (name.encode('utf-8'), i)
+      filename = 'easy/%s/f-%04d.png' % (name, i)
+      with open(filename, 'wb') as out:
+        out.write(data)
+      responses[filename] = _response(i + offset)
+      if store:
+        cloud_vision.get_analysis_store().put(hashlib.sha256(data).hexdigest(),
+                                              ImageAnalysis.deserialize(responses[filename]))
+  return responses
+
+
+# spawned workers import cloud_vision's defaults, e.g. near_duplicate_distance = 4 instead of the None set here
+@pytest.mark.parametrize('start_method', ['fork', 'spawn'])
+def test_parallel_book_is_the_serial_book(workdir, monkeypatch, start_method):
+  monkeypatch.setattr(cloud_vision, 'worker_start_method', start_method)
+  _store_chapters(['c1', 'c2', 'c3'])
+  monkeypatch.setattr(cloud_vision, '_book_rows', lambda: iter([('c1', 'One'), ('c2', 'Two'), ('c3', 'Three')]))
+  monkeypatch.setattr(cloud_vision, 'run_pandoc', lambda prefix: None)
+  monkeypatch.setattr(cloud_vision, 'memoize_chapters', False)
+  cloud_vision.main(workers=3, seed=7)
+  with open('book.md', 'rt', encoding='utf-8') as f:
+    parallel = f.read()
+  corpus = cloud_vision.get_corpus()
+  parallel_frames = {name: corpus.chapter_frames(name) for name in corpus.chapters}
+  cloud_vision.main(workers=1, seed=7)
+  with open('book.md', 'rt', encoding='utf-8') as f:
+    assert f.read() == parallel
+  assert {name: corpus.chapter_frames(name) for name in corpus.chapters} == parallel_frames
+  cloud_vision.main(workers=1, seed=8)
+  with open('book.md', 'rt', encoding='utf-8') as f:
+    assert f.read() != parallel
+
+
+def test_second_run_reuses_chapters_analyzed_during_the_first(workdir, monkeypatch):
+  # the first run analyzes every frame, so the hierarchy grows while the chapters are built
+  responses = _store_chapters(['c1', 'c2', 'c3'], store=False)
+  calls = []
+
+  def call_with_retries(filename, call, bucket):
+    calls.append(filename)
+    return ImageAnalysis.deserialize(responses[filename])
+
+  monkeypatch.setattr(cloud_vision.vision_pipeline, 'call_with_retries', call_with_retries)
+  monkeypatch.setattr(cloud_vision, 'allow_azure_calls', True)
+  monkeypatch.setattr(cloud_vision, '_book_rows', lambda: iter([('c1', 'One'), ('c2', 'Two'), ('c3', 'Three')]))
+  monkeypatch.setattr(cloud_vision, 'run_pandoc', lambda prefix: None)
+  monkeypatch.setattr(cloud_vision, 'memoize_chapters', True)
+  cloud_vision.main(workers=1, seed=7)
+  assert len(calls) == 60
+  assert cloud_vision.metrics.book.events['chapter_cache_miss'] == 3
+  with open('book.md', 'rt', encoding='utf-8') as f:
+    first = f.read()
+
+  cloud_vision.main(workers=1, seed=7)
+  assert len(calls) == 60
+  assert cloud_vision.metrics.book.events['chapter_cache_hit'] == 3
+  assert cloud_vision.metrics.book.events['chapter_cache_miss'] == 0
+  with open('book.md', 'rt', encoding='utf-8') as f:
+    assert f.read() == first
+
+
+if __name__ == '__main__':
+  pytest.main()
@@ -0,0 +1,74 @@
+import json
+import os
+
+import pytest
+
+import debug_sink
+from debug_sink import DebugSink
+
+
+def _chapter(sink):
+  sink.begin_lines('Chapter')
+  sink.add_line('Chapter', ['A dog.', 'Sky.'])
+  sink.add_line('Chapter', [])
+  sink.end_lines('Chapter')
+  sink.flush()
+
+
+def test_files_layout(tmp_path, monkeypatch):
+  monkeypatch.chdir(tmp_path)
+  os.makedirs('.debug-lines')
+  _chapter(DebugSink('files'))
+  text = open('.debug-lines/Chapter.json').read()
+  assert text == json.dumps([['A dog.', 'Sky.'], []], indent=2)
+
+
+def test_ndjson(tmp_path, monkeypatch):
+  monkeypatch.chdir(tmp_path)
+  os.makedirs('.debug')
+  os.makedirs('.debug-lines')
+  sink = DebugSink('ndjson')
+  _chapter(sink)
+  assert [json.loads(l) for l in open('.debug-lines/Chapter.ndjson')] == [['A dog.', 'Sky.'], []]
+
+  sink.analysis('easy/video/video-0001.png', {'tags': ['dog']})
+  sink.analysis('easy/video/video-0001.png', {'tags': ['dog']})
+  sink.flush()
+  # a new run doesn't append the frames that are already there
+  again = DebugSink('ndjson')
+  again.analysis('easy/video/video-0001.png', {'tags': ['dog']})
+  again.analysis('easy/video/video-0002.png', {'tags': ['sky']})
+  again.flush()
+  records = [json.loads(l) for l in open('.debug/video.ndjson')]
+  assert [r['frame'] for r in records] == ['video-0001', 'video-0002']
+  assert records[1]['analysis'] == {'tags': ['sky']}
+
+
+def test_ndjson_keeps_the_file_open(tmp_path, monkeypatch):
+  monkeypatch.chdir(tmp_path)
+  os.makedirs('.debug')
+  opened = []
+
+  def counting_open(path, *args, **kwargs):
+    opened.append(path)
+    return open(path, *args, **kwargs)
+
+  monkeypatch.setattr(debug_sink, 'open', counting_open, raising=False)
+  sink = DebugSink('ndjson')
+  for i in range(50):
+    sink.analysis('easy/video/video-%04d.png' % i, {'tags': ['dog']})
+  sink.flush()
+  assert opened == ['.debug/video.ndjson']
+  assert len(open('.debug/video.ndjson').readlines()) == 50
+
+
+def test_off(tmp_path, monkeypatch):
+  monkeypatch.chdir(tmp_path)
+  sink = DebugSink('off')
+  _chapter(sink)
+  sink.analysis('easy/video/video-0001.png', {})
+  assert not os.listdir(tmp_path)
+
+
+if __name__ == '__main__':
+  pytest.main()
@@ -5,6 +5,7 @@ import zipfile
 import pytest
 from azure.cognitiveservices.vision.computervision.models import ImageAnalysis
 
+import analysis_providers
 import cloud_vision
 import generate_frames
 
@@ -30,11 +31,9 @@ def test_example_different_windows():
   base_path = generate_frames.extractImages('example/Survival1951.mp4', 'example', 15000, start_at=2)
   assert base_path == 'example/Survival1951@15000'
   word_count_for_window = {}
-  for w in windows:
-    lines = cloud_vision.gen_for_directory(base_path, 'Survival 1951', filename='1951@' + str(w) + '.md',
-                                           window=w, randomize_order=False)
+  for w, (lines, words) in cloud_vision.gen_for_windows(base_path, 'Survival 1951', windows, randomize_order=False).items():
     cloud_vision.writelines('example/manual-eval-1951@' + str(w) + '.md', lines)
-    word_count_for_window[w] = len(' '.join(lines).split(' '))
+    word_count_for_window[w] = words
 
   assert word_count_for_window == {1: 591, 2: 519, 4: 467, 8: 421, 16: 393, 32: 368}
 
@@ -56,5 +55,21 @@ def test_json_zip_loading():
   # and that we lost nothing in round-tripping the object
   assert d == round_trip_dict
 
+def test_zip_provider():
+  provider = analysis_providers.ZipAnalysisProvider('json-analyze.zip')
+  frames = provider.frames('example/Survival1951')
+  assert 'example/Survival1951/Survival1951-0002.png' in frames
+  analysis = provider.get('example/Survival1951/Survival1951-0002.png')
+  assert analysis.request_id == '77b89155-d795-4759-b103-eb35dbedfb28'
+  assert provider.get('example/Survival1951/Survival1951-0002.png') is analysis
+  assert provider.get('example/Survival1951/missing.png') is None
+
+  # no frames, secrets or Azure needed
+  lines = cloud_vision.gen_for_directory('example/Survival1951', 'Survival 1951', filename='Survival-1951-zip.md',
+                                         randomize_order=False, provider=provider)
+  assert lines[0] == '# Survival 1951'
+  assert len(lines) > len(frames) // 2
+
+
 if __name__ == '__main__':
   pytest.main()
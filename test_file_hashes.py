@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+import file_hashes
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+  monkeypatch.setattr(file_hashes, 'journal_file', str(tmp_path / '_file_hashes.jsonl'))
+  monkeypatch.setattr(file_hashes, '_known', None)
+  monkeypatch.setattr(file_hashes, 'compact_journal', True)
+  frame = tmp_path / 'f-0001.png'
+  frame.write_bytes(b'frame')
+  # the same frame recorded over and over, as after many regenerations
+  st = file_hashes._stat_key(os.stat(str(frame)))
+  for _ in range(1500):
+    file_hashes._record([(str(frame), st, 'digest')])
+  monkeypatch.setattr(file_hashes, '_known', None)
+  return file_hashes.journal_file
+
+
+def _lines(path):
+  with open(path, 'rt', encoding='utf-8') as f:
+    return len(f.readlines())
+
+
+def test_the_parent_compacts_the_journal(journal):
+  file_hashes.load()
+  assert _lines(journal) == 1
+
+
+def test_workers_only_append(journal, monkeypatch):
+  monkeypatch.setattr(file_hashes, 'compact_journal', False)
+  file_hashes.load()
+  assert _lines(journal) == 1500
+  assert len(file_hashes._known) == 1
+
+
+if __name__ == '__main__':
+  pytest.main()
@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+import frame_dedup
+
+
+@pytest.fixture
+def dhashes(tmp_path, monkeypatch):
+  # the frames' dhashes by name, instead of decoding images
+  values = {}
+  monkeypatch.setattr(frame_dedup, 'cache_file', str(tmp_path / '_near_duplicates.json'))
+  monkeypatch.setattr(frame_dedup, '_cache', None)
+  monkeypatch.setattr(frame_dedup, '_unsaved', {})
+  monkeypatch.setattr(frame_dedup, 'dhash', lambda filename, data=None: values[filename])
+  return values
+
+
+def test_runs_collapse_to_their_first_frame(dhashes):
+  dhashes.update({'a': 0, 'b': 0b111, 'c': 0xff00, 'd': 0xff01})
+  assert frame_dedup.collapse(['a', 'b', 'c', 'd'], ['ha', 'hb', 'hc', 'hd'], 4) == {'a': 'a', 'b': 'a', 'c': 'c', 'd': 'c'}
+  assert frame_dedup.collapse(['a', 'b', 'c', 'd'], ['ha', 'hb', 'hc', 'hd'], 2) == {'a': 'a', 'b': 'b', 'c': 'c', 'd': 'c'}
+
+
+def test_flush_keeps_what_other_processes_saved(dhashes):
+  dhashes.update({'a': 1, 'b': 2})
+  frame_dedup.get_dhash('a', 'ha')
+  # another worker saved its dhashes since this one loaded the cache
+  with open(frame_dedup.cache_file, 'w') as out:
+    json.dump({'dhash': {'hz': '%016x' % 26}}, out)
+  frame_dedup.flush()
+  frame_dedup.get_dhash('b', 'hb')
+  frame_dedup.flush()
+  with open(frame_dedup.cache_file) as f:
+    assert json.load(f) == {'dhash': {'ha': '%016x' % 1, 'hb': '%016x' % 2, 'hz': '%016x' % 26}}
+
+
+if __name__ == '__main__':
+  pytest.main()
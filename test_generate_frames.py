@@ -0,0 +1,38 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import generate_frames
+
+
+def _write_video(path, seconds=30, fps=10):
+  # a new flat colour every 2.3 seconds
+  out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (64, 36))
+  for i in range(seconds * fps):
+    out.write(np.full((36, 64, 3), int(i / fps / 2.3) * 37 % 256, np.uint8))
+  out.release()
+
+
+def _frames(directory):
+  # extractImages joins with backslashes, which are part of the file names elsewhere
+  return sorted(f.replace('\\', '/') for _, _, files in os.walk(directory) for f in files if f.endswith('.png'))
+
+
+@pytest.mark.parametrize('scenes', [None, generate_frames.SceneSampling()])
+def test_workers_write_the_same_frames(tmp_path, monkeypatch, scenes):
+  monkeypatch.setattr(generate_frames, 'min_segment_ms', 5000)
+  video = str(tmp_path / 'video.avi')
+  _write_video(video)
+  written = {}
+  for workers in (1, 4):
+    os.makedirs(str(tmp_path / ('w%d' % workers) / 'out'))
+    monkeypatch.chdir(tmp_path / ('w%d' % workers))
+    generate_frames.extractImages(video, 'out', 500, workers=workers, scenes=scenes)
+    written[workers] = _frames('.')
+  assert written[1] and written[1] == written[4]
+
+
+if __name__ == '__main__':
+  pytest.main()
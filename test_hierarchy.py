@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+
+import pytest
+
+from hierarchy import Hierarchy
+
+
+def _object(*path):
+  o = None
+  for name in reversed(path):
+    o = SimpleNamespace(object_property=name, parent=o)
+  return o
+
+
+def _analysis(*objects):
+  return SimpleNamespace(objects=list(objects))
+
+
+def test_ancestors_are_precomputed_and_persisted(tmp_path):
+  journal = str(tmp_path / 'hierarchy.jsonl')
+  h = Hierarchy(journal)
+  assert not h.exists
+  assert h.add_analysis(_analysis(_object('Guitar', 'String instrument', 'Musical instrument'), _object('person'))) == 2
+  assert h.add_analysis(_analysis(_object('Electric guitar', 'Guitar'))) == 1
+  assert h.add_analysis(_analysis(_object('guitar', 'string instrument'))) == 0
+
+  assert h.get_generic_terms_for('electric guitar') == ['guitar', 'string instrument', 'musical instrument']
+  assert h.get_generic_terms_for('person') == []
+
+  reloaded = Hierarchy(journal)
+  assert reloaded.exists
+  assert reloaded.get_generic_terms_for('guitar') == ['string instrument', 'musical instrument']
+
+
+if __name__ == '__main__':
+  pytest.main()
@@ -0,0 +1,33 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# importing cloud_vision for the text functions shouldn't pull in the heavy dependencies, touch the caches or make
+# directories (see the top of cloud_vision)
+heavy = ['pandas', 'azure', 'msrest', 'tqdm', 'jsonpickle', 'cv2', 'numpy']
+max_seconds = 1.0
+
+check = '''
+import sys, time
+start = time.perf_counter()
+import cloud_vision
+elapsed = time.perf_counter() - start
+print(elapsed)
+print(' '.join(m for m in %r if m in sys.modules))
+''' % heavy
+
+
+def test_import_is_light(tmp_path):
+  here = os.path.dirname(os.path.abspath(__file__))
+  env = dict(os.environ, PYTHONPATH=os.pathsep.join([here] + sys.path))
+  out = subprocess.run([sys.executable, '-c', check], cwd=str(tmp_path), env=env, check=True,
+                       stdout=subprocess.PIPE, universal_newlines=True).stdout.split('\n')
+  assert out[1] == '', 'imported on import: ' + out[1]
+  assert float(out[0]) < max_seconds, out[0]
+  assert os.listdir(str(tmp_path)) == []
+
+
+if __name__ == '__main__':
+  pytest.main()
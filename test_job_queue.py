@@ -0,0 +1,49 @@
+import pytest
+
+from job_queue import JobQueue, refinement_priority
+
+
+def test_refinement_priority():
+  assert [refinement_priority(i) for i in range(9)] == [0, 3, 2, 3, 1, 3, 2, 3, 0]
+
+
+def test_resume(tmp_path):
+  journal = str(tmp_path / 'queue.jsonl')
+  queue = JobQueue(journal)
+  frames = ['v/v-%04d.png' % i for i in range(10)]
+  assert queue.add((f, refinement_priority(i), [100, i]) for i, f in enumerate(frames)) == 10
+  assert queue.add([(frames[0], 0, [100, 0])]) == 0
+
+  first = queue.take(4)
+  assert first == ['v/v-0000.png', 'v/v-0008.png', 'v/v-0004.png', 'v/v-0002.png']
+  queue.done(first[:3])
+  assert len(queue) == 7
+  queue.close()
+
+  # the job that was taken but not done is queued again
+  resumed = JobQueue(journal)
+  assert len(resumed) == 7
+  assert resumed.depth_by_priority() == {2: 2, 3: 5}
+  assert resumed.take(2) == ['v/v-0002.png', 'v/v-0006.png']
+  assert resumed.eta(0.5) == 14
+  resumed.close()
+
+
+def test_regenerated_frames_are_queued_again(tmp_path):
+  journal = str(tmp_path / 'queue.jsonl')
+  queue = JobQueue(journal)
+  queue.add([('v/v-0000.png', 0, [100, 1]), ('v/v-0001.png', 3, [100, 1])])
+  queue.done(queue.take(2))
+  assert len(queue) == 0
+  # same name, new content
+  assert queue.add([('v/v-0000.png', 0, [100, 1]), ('v/v-0001.png', 3, [120, 2])]) == 1
+  queue.close()
+
+  resumed = JobQueue(journal)
+  assert len(resumed) == 1
+  assert resumed.take(5) == ['v/v-0001.png']
+  resumed.close()
+
+
+if __name__ == '__main__':
+  pytest.main()
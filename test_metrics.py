@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+import metrics
+
+
+def test_book_and_chapters(tmp_path):
+  metrics.reset()
+  metrics.begin_chapter('one')
+  with metrics.stage('reducer'):
+    pass
+  metrics.count('cache_hit', 3)
+  one = metrics.end_chapter()
+  assert one['calls'] == {'reducer': 1}
+  assert one['events'] == {'cache_hit': 3}
+
+  # a chapter from a worker process
+  metrics.add_chapter('two', {'seconds': {'reducer': 0.5}, 'calls': {'reducer': 2}, 'events': {'cache_miss': 1}})
+  metrics.timed('pandoc')(lambda: None)()
+
+  report = metrics.report()
+  assert report['book']['calls'] == {'pandoc': 1, 'reducer': 3}
+  assert report['book']['events'] == {'cache_hit': 3, 'cache_miss': 1}
+  assert set(report['chapters']) == {'one', 'two'}
+
+  metrics.write_json(str(tmp_path / 'metrics.json'))
+  assert json.load(open(str(tmp_path / 'metrics.json')))['chapters']['two']['seconds'] == {'reducer': 0.5}
+  metrics.write_prometheus(str(tmp_path / 'metrics.prom'))
+  prom = open(str(tmp_path / 'metrics.prom')).read().split('\n')
+  assert 'nanogenmo_book_events_total{event="cache_miss"} 1' in prom
+  assert 'nanogenmo_chapter_stage_calls_total{chapter="two",stage="reducer"} 2' in prom
+  metrics.reset()
+
+
+if __name__ == '__main__':
+  pytest.main()
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+import pandoc_fragments
+
+
+def test_only_changed_chapters_are_converted(tmp_path, monkeypatch):
+  converted = []
+
+  def render(chunk, path, id_prefix):
+    converted.append(chunk.splitlines()[0])
+    with open(path, 'wt', encoding='utf-8') as out:
+      out.write('\\section{%s}\\label{%s}\n' % (chunk.splitlines()[0], id_prefix))
+
+  monkeypatch.setattr(pandoc_fragments, '_pandoc_version', lambda: 'pandoc 3.1')
+  monkeypatch.setattr(pandoc_fragments, '_render', render)
+  book = str(tmp_path / 'book.md')
+  fragments = str(tmp_path / 'latex')
+  chapters = ['\\pagebreak\n\n', '# One\n\nDog. Snow.\n\n\\pagebreak\n\n', '# Two\n\nCat.\n']
+  with open(book, 'wt', encoding='utf-8') as out:
+    out.write(''.join(chapters))
+  assert pandoc_fragments.split_chapters(''.join(chapters)) == chapters
+
+  document = pandoc_fragments.assemble(book, fragments)
+  assert sorted(converted) == ['# One', '# Two', '\\pagebreak']
+  with open(document, 'rt', encoding='utf-8') as f:
+    text = f.read()
+  assert text.index('\\section{# One}') < text.index('\\section{# Two}')
+  assert text.count('```{=latex}') == 3
+
+  converted.clear()
+  with open(book, 'wt', encoding='utf-8') as out:
+    out.write(''.join(chapters[:2]) + '# Two\n\nCat. Tree.\n')
+  pandoc_fragments.assemble(book, fragments)
+  assert converted == ['# Two']
+  assert len(os.listdir(fragments)) == 5  # 4 fragments + the document
+
+
+def test_fragments_keep_what_the_writer_would_see(tmp_path, monkeypatch):
+  def render(chunk, path, id_prefix):
+    with open(path, 'wt', encoding='utf-8') as out:
+      out.write('\\section{One}\\label{%sone}\n%s\n' % (id_prefix, chunk.replace('~~', '\\sout{', 1)))
+
+  monkeypatch.setattr(pandoc_fragments, '_pandoc_version', lambda: 'pandoc 3.1')
+  monkeypatch.setattr(pandoc_fragments, '_render', render)
+  book = str(tmp_path / 'book.md')
+  with open(book, 'wt', encoding='utf-8') as out:
+    out.write('# One\n\nDog.\n\n# One\n\nDog.\n\n# One\n\nCat.\n')
+  document = pandoc_fragments.assemble(book, str(tmp_path / 'latex'))
+  with open(document, 'rt', encoding='utf-8') as f:
+    labels = [line for line in f.read().splitlines() if line.startswith('\\section')]
+  # the same title, and even the same chapter twice, get different labels
+  assert len(set(labels)) == 3
+  assert pandoc_fragments.template_args(document) == []
+
+  with open(book, 'wt', encoding='utf-8') as out:
+    out.write('# One\n\nDog. ~~Cat.~~\n')
+  document = pandoc_fragments.assemble(book, str(tmp_path / 'latex'))
+  assert pandoc_fragments.template_args(document) == ['-V', 'strikeout']
+
+
+if __name__ == '__main__':
+  pytest.main()
@@ -0,0 +1,19 @@
+import pytest
+
+from phrase_records import Phrase, PhraseSet
+
+
+def test_first_source_wins():
+  x = PhraseSet()
+  assert x.add('a dog in the snow', 'caption', 0.5)
+  assert x.add('dog', 'tag', 0.99)
+  assert not x.add('dog', 'object', 0.8, 0)
+  assert x.add('snow', 'tag')
+  assert x.texts() == ['a dog in the snow', 'dog', 'snow']
+  assert 'dog' in x and 'cat' not in x
+  assert x.get('dog') == Phrase('dog', 'tag', 0.99)
+  assert [p.text for p in x if p.confidence and p.confidence > 0.9] == ['dog']
+
+
+if __name__ == '__main__':
+  pytest.main()
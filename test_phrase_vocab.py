@@ -0,0 +1,56 @@
+import pytest
+
+from phrase_vocab import Corpus, Vocabulary
+
+
+def test_corpus_statistics(tmp_path):
+  path = str(tmp_path / 'phrases.jsonl')
+  c = Corpus(Vocabulary(path))
+  c.add_chapter('One', [['Dog', 'Snow'], ['Snow'], ['Cat', 'Snow']])
+  c.add_chapter('Two', [['Cat'], ['Tree', 'Cat']])
+  assert c.most_common(2) == [('Snow', 3), ('Cat', 3)]
+  assert c.most_common(5, 'Two') == [('Cat', 2), ('Tree', 1)]
+  assert c.first_appearance('One') == ['Dog', 'Snow', 'Cat']
+  assert c.chapters_with('Cat') == ['One', 'Two']
+  assert c.shared_phrases().tolist() == [[3, 1], [1, 2]]
+  assert c.chapter_frames('Two') == [['Cat'], ['Tree', 'Cat']]
+
+  # the ids are kept across runs, a torn last line is dropped
+  c.save(str(tmp_path / 'corpus.npz'))
+  with open(path, 'at') as out:
+    out.write('"Torn')
+  v = Vocabulary(path)
+  assert len(v) == 4 and v.id_of('Cat') == 2 and 'Torn' not in v
+  assert v.intern(['New']) == [4]
+  loaded = Corpus.load(str(tmp_path / 'corpus.npz'), v)
+  assert loaded.most_common(2) == c.most_common(2)
+
+
+def test_chapters_move_between_vocabularies():
+  # a worker's vocabulary has other ids than its parent's
+  worker = Corpus(Vocabulary())
+  worker.add_chapter('Old', [['Tree'], ['Dog']])
+  builder = worker.chapter_builder()
+  for frame in [['Snow', 'Dog'], [], ['Cat', 'Snow']]:
+    builder.add_frame(frame)
+  worker.chapters['One'] = builder.stats()
+  texts, ids, offsets = worker.portable_chapter('One')
+  assert texts == ['Snow', 'Dog', 'Cat']
+  assert ids.tolist() == [0, 1, 2, 0] and offsets.tolist() == [0, 2, 2, 4]
+
+  parent = Corpus(Vocabulary())
+  parent.add_chapter('Two', [['Cat']])
+  parent.add_portable_chapter('One', texts, ids.tolist(), offsets.tolist())
+  assert parent.chapter_frames('One') == [['Snow', 'Dog'], [], ['Cat', 'Snow']]
+  serial = Corpus(Vocabulary())
+  serial.add_chapter('Two', [['Cat']])
+  serial.add_chapter('One', [['Snow', 'Dog'], [], ['Cat', 'Snow']])
+  assert parent.chapters['One'].ids.tolist() == serial.chapters['One'].ids.tolist()
+
+  worker.add_chapter('Blank', [[]])
+  parent.add_portable_chapter('Blank', *worker.portable_chapter('Blank'))
+  assert parent.chapter_frames('Blank') == [[]]
+
+
+if __name__ == '__main__':
+  pytest.main()
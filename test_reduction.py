@@ -6,7 +6,7 @@ from typing import List
 
 import pytest
 
-from cloud_vision import reduce, _reducer, is_overlap, is_overlap_or_exact, get_generic_terms_for
+from cloud_vision import reduce, _reducer, reduce_many, is_overlap, is_overlap_or_exact, get_generic_terms_for, apply_window
 
 
 def test_0():
@@ -117,6 +117,25 @@ def test_13():
   assert k == ['roadway']
 
 
+def test_reduce_many():
+  frames = [['a man', 'man'], ['dark', 'darkness'], ['a man', 'man'], ['road', 'roadway', 'way']]
+  results = reduce_many(frames)
+  assert results == [_reducer(f) for f in frames]
+  # identical frames are reduced once, but the caller still gets lists it can modify
+  results[0][1].append('extra')
+  assert results[2] == (['a man'], ['man'])
+
+
+def test_apply_window():
+  keeps = [(['Dog', 'Sky'], []), (['Dog'], ['dogs']), (['Dog', 'Cat'], []), (['Dog'], [])]
+  assert apply_window('H', keeps, 1, False) == ['# H', 'Dog. Sky.', 'Dog.', 'Dog. Cat.', 'Dog.']
+  # a line with nothing left doesn't count towards the window
+  assert apply_window('H', keeps, 2, False, include_removed=True) == ['# H', 'Dog. Sky.', '', '~~dogs Dog~~', 'Cat. ~~Dog~~',
+                                                                      'Dog.']
+  # the removed lists belong to the caller, so several windows can share one set of keeps
+  assert keeps[1] == (['Dog'], ['dogs'])
+
+
 def to_word_stream(lines: List[List[str]]) -> Iterable[str]:
   for words in lines:
     yield from words
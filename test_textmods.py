@@ -0,0 +1,70 @@
+import random
+from collections import Counter
+
+import pytest
+
+import textmods
+
+example = ['A group of people with their hands up in the air.', 'Television.', 'Flat.', 'Display.', 'Music.']
+
+
+def test_do_anything_is_reproducible():
+  rng = random.Random(42)
+  first = [textmods.do_anything(list(example), rng) for _ in range(20)]
+  rng = random.Random(42)
+  second = [textmods.do_anything(list(example), rng) for _ in range(20)]
+  assert first == second
+  assert len(set(' '.join(f) for f in first)) > 1
+
+
+def test_do_anything_returns_one_of_do_everything():
+  rng = random.Random(1)
+  everything = set(' '.join(v) for v in textmods.do_everything(example, random.Random(0)))
+  for _ in range(50):
+    v = textmods.do_anything(list(example), rng)
+    assert ' '.join(v) in everything or sorted(v) == sorted(example)  # sort_shuffle is random every time
+
+
+def test_do_anything_distinct_results_are_equally_likely():
+  # do_nothing, both sorts and both single word joins give only 2 different results between them
+  rng = random.Random(7)
+  counts = Counter(' '.join(textmods.do_anything(['A.', 'B.'], rng)) for _ in range(3000))
+  assert set(counts) == {'A. B.', 'A, b.', 'B. A.'}
+  assert all(900 < n < 1100 for n in counts.values()), counts
+
+
+def test_earlier_results_are_known_without_running_them():
+  gen = random.Random(5)
+  phrases = ['Dog.', 'Cat.', 'A man.', 'A man playing a guitar.', 'Tree.', 'Night sky.', 'TV.', 'a b.', 'Dog.']
+  for _ in range(300):
+    words = [gen.choice(phrases) for _ in range(gen.randint(1, 6))]
+    textmods._note_appearance(words)
+    results = [textmods._apply(t, words, random.Random(0)) for t in textmods._registry]
+    for func, check in textmods._would_return.items():
+      expected = textmods._apply((func, False), words, None)
+      for values in results:
+        same = check(words, values)
+        assert same is None or same == (values == expected), (func.__name__, words, values)
+
+
+def test_do_anything_many_is_one_rng_sequence():
+  lines = [list(example), ['A.', 'B.'], example[:3]]
+  rng = random.Random(11)
+  one_by_one = [textmods.do_anything(list(words), rng) for words in lines]
+  assert textmods.do_anything_many(lines, random.Random(11)) == one_by_one
+
+
+def test_do_anything_does_not_change_input():
+  words = list(example)
+  textmods.do_anything(words, random.Random(3))
+  assert words == example
+
+
+def test_join_until_n():
+  words = textmods._join_until_n(['A.', 'B.', 'C.', 'D.'], 2, random.Random(0))
+  assert len(words) == 2
+  assert sorted(', '.join(words).lower().replace('.', '').split(', ')) == ['a', 'b', 'c', 'd']
+
+
+if __name__ == '__main__':
+  pytest.main()
@@ -0,0 +1,31 @@
+import cv2
+import numpy as np
+import pytest
+
+import upload_payload
+from upload_payload import PayloadProfile
+
+
+def test_cache_key():
+  h = 'a' * 64
+  assert upload_payload.cache_key(h, None) == h
+  small = upload_payload.cache_key(h, PayloadProfile(640, '.jpg', 90))
+  assert len(small) == 64 and small != h
+  assert small != upload_payload.cache_key(h, PayloadProfile(640, '.jpg', 80))
+
+
+def test_prepare_downscales():
+  image = np.random.RandomState(0).randint(0, 255, (1080, 1920, 3), np.uint8)
+  success, png = cv2.imencode('.png', image)
+  assert success
+  png = png.tobytes()
+  frames = upload_payload.stats.frames
+  jpg = upload_payload.prepare(png, PayloadProfile(640, '.jpg', 85))
+  assert len(jpg) < len(png)
+  assert cv2.imdecode(np.frombuffer(jpg, np.uint8), cv2.IMREAD_COLOR).shape == (360, 640, 3)
+  assert upload_payload.stats.frames == frames + 1
+  assert upload_payload.prepare(png, None) is png
+
+
+if __name__ == '__main__':
+  pytest.main()
@@ -0,0 +1,85 @@
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+import stand_in_vision
+import vision_pipeline
+from vision_pipeline import TierProfile, TokenBucket
+
+
+class Throttled(Exception):
+  def __init__(self, retry_after):
+    super().__init__(retry_after)
+    self.response = type('Response', (), {'status_code': 429, 'headers': {'Retry-After': retry_after}})()
+
+
+def test_token_bucket_burst_then_rate():
+  bucket = TokenBucket(TierProfile(rate=100, burst=3))
+  assert [bucket.try_acquire() for _ in range(3)] == [0, 0, 0]
+  assert 0 < bucket.try_acquire() <= 0.01
+
+
+def test_free_tier_never_exceeds_its_quota(monkeypatch):
+  # a fake clock, sleep only moves it forward
+  now = [1000.0]
+  monkeypatch.setattr(vision_pipeline.time, 'monotonic', lambda: now[0])
+  monkeypatch.setattr(vision_pipeline.time, 'sleep', lambda seconds: now.__setitem__(0, now[0] + seconds))
+  bucket = TokenBucket(vision_pipeline.tier_profiles['F0'])
+  times = []
+  for _ in range(100):
+    bucket.acquire()
+    times.append(now[0])
+  assert max(sum(1 for t in times if start <= t < start + 61) for start in times) <= 20
+  assert times[-1] - times[0] < 99 * 61 / 20 + 1
+
+
+def test_throttled_pauses_and_slows_down():
+  bucket = TokenBucket(TierProfile(rate=100, burst=3))
+  bucket.throttled(0.5)
+  assert bucket.try_acquire() > 0.4
+  assert bucket.rate == 50
+  bucket.succeeded()
+  assert bucket.rate == 55
+
+
+def test_retry_after():
+  assert vision_pipeline.get_retry_after(Throttled('7'), 1) == 7.0
+  assert vision_pipeline.get_retry_after(Throttled(None), 3) == 8.0
+  assert vision_pipeline.get_retry_after(ValueError(), 1) is None
+
+
+def test_run_concurrently_retries_throttled_calls():
+  attempts = {}
+
+  def call(item):
+    attempts[item] = attempts.get(item, 0) + 1
+    if item == 3 and attempts[item] == 1:
+      raise Throttled('0.01')
+    return item * 2
+
+  bucket = TokenBucket(TierProfile(rate=1000, burst=10))
+  results = dict(vision_pipeline.run_concurrently(range(10), call, bucket, concurrency=4))
+  assert results == {i: i * 2 for i in range(10)}
+  assert attempts[3] == 2
+
+
+def test_stand_in_endpoint_throttles():
+  server = stand_in_vision.serve(tier='F0', latency=0)
+  url = stand_in_vision.endpoint_for(server) + 'vision/v3.2/analyze'
+  statuses = []
+  start = time.time()
+  for _ in range(21):
+    try:
+      statuses.append(urllib.request.urlopen(urllib.request.Request(url, data=b'png', method='POST')).status)
+    except urllib.error.HTTPError as e:
+      statuses.append(e.code)
+      assert int(e.headers['Retry-After']) > 0
+  server.shutdown()
+  assert time.time() - start < 10
+  assert statuses == [200] * 20 + [429]
+
+
+if __name__ == '__main__':
+  pytest.main()
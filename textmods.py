@@ -1,27 +1,38 @@
 import inspect
 import random
-from typing import List, Dict
+import sys
+from collections import defaultdict, deque
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
 
 def do_nothing(words):
   return words
 
 
+def _spaces_then_length(x):
+  return -x.count(' '), len(x)
+
+
+def _spaces_then_alpha(x):
+  return -x.count(' '), x
+
+
 def sort_by_spaces_then_length(words):
-  return sorted(words, key=lambda x: (-x.count(' '), len(x)))
+  return sorted(words, key=_spaces_then_length)
 
 
 def sort_by_spaces_then_alpha(words):
-  return sorted(words, key=lambda x: (-x.count(' '), x))
+  return sorted(words, key=_spaces_then_alpha)
 
 
-def sort_shuffle(words):
-  if len(words) == 1:
+# the random transforms take rng=random.Random(...) for reproducible output, or use the global random module
+def sort_shuffle(words, rng=random):
+  if len(words) == 1 or len(set(words)) == 1:
     return words
   before = list(words)
   while before == words:
     # print('shuffling')
-    random.shuffle(words)
+    rng.shuffle(words)
   return words
 
 
@@ -29,40 +40,39 @@ def sort_reverse(words):
   return list(reversed(words))
 
 
-def join_until_1(words):
-  return _join_until_n(words, 2)
+def join_until_1(words, rng=random):
+  return _join_until_n(words, 2, rng)
 
 
-def join_until_2(words):
-  return _join_until_n(words, 2)
+def join_until_2(words, rng=random):
+  return _join_until_n(words, 2, rng)
 
 
-def join_until_3(words):
-  return _join_until_n(words, 3)
+def join_until_3(words, rng=random):
+  return _join_until_n(words, 3, rng)
 
 
-def join_until_4(words):
-  return _join_until_n(words, 4)
+def join_until_4(words, rng=random):
+  return _join_until_n(words, 4, rng)
 
 
-def join_until_halved(words):
-  return _join_until_n(words, len(words) // 2)
+def join_until_halved(words, rng=random):
+  return _join_until_n(words, len(words) // 2, rng)
 
 
-def _join_until_n(words: List[str], n: int) -> List[str]:
-  if len(words) <= n:
-    return words
+def _join_until_n(words: List[str], n: int, rng=random) -> List[str]:
+  while len(words) > n:
+    i, j = sorted(rng.sample(range(len(words)), 2), reverse=True)
+    first, second = words[i], words[j]
+    del words[i]
+    del words[j]
+    first = first.lower().rstrip(',. ')
+    second = second.lower().rstrip(',. ')
+    c = first + ', ' + second + '.'
+    c = c[0].upper() + c[1:]
+    words.append(c)
 
-  first, second = random.sample(words, 2)
-  words.remove(first)
-  words.remove(second)
-  first = first.lower().rstrip(',. ')
-  second = second.lower().rstrip(',. ')
-  c = first + ', ' + second + '.'
-  c = c[0].upper() + c[1:]
-  words.append(c)
-
-  return _join_until_n(words, n)
+  return words
 
 
 def join_single_front(words):
@@ -90,45 +100,145 @@ def _join_single_words(words, at_beginning):
   return ret
 
 
-def do_everything(words):
-  current_module = __import__(__name__)
+def _is_transform(name, func):
+  if name in {'do_everything', 'do_anything', 'do_anything_many', 'reset_appearance'}:
+    return False
+  if name.startswith('_') or '_until_' in name:
+    return False
+  return inspect.getmodule(func) is sys.modules[__name__]
+
+
+# [(transform, whether it takes rng)]
+def _build_registry() -> List[Tuple[Callable, bool]]:
+  current_module = sys.modules[__name__]
+  return [(func, 'rng' in inspect.signature(func).parameters)
+          for name, func in inspect.getmembers(current_module, inspect.isfunction) if _is_transform(name, func)]
+
+
+def _apply(transform, words, rng) -> List[str]:
+  func, takes_rng = transform
+  copy = list(words)
+  values = func(copy, rng) if takes_rng else func(copy)
+  assert isinstance(values, list), (func.__name__, values)
+  return values
+
+
+def do_everything(words, rng=random):
   seen = set()
-  for name, func in inspect.getmembers(current_module, inspect.isfunction):
-    if name in {'do_everything', 'do_anything'}:
-      continue
-    if name.startswith('_') or '_until_' in name:
-      continue
-    copy = list(words)
-    values = func(copy)
-    assert isinstance(values, list), (name, values)
+  for transform in _registry:
+    func = transform[0]
+    values = _apply(transform, words, rng)
     v = ' '.join(values)
     if v in seen:
       continue
     if v.startswith('.'):
-      assert False, (name, words, values)
+      assert False, (func.__name__, words, values)
     seen.add(v)
     yield values
 
 
-def do_anything(words) -> List[str]:
+# picks a transform at random instead of running all of them, but every distinct result is as likely as when
+# do_everything's results were deduplicated: a result only counts for the first transform (in registry order) that
+# produces it, so a transform that repeats an earlier one's result means drawing again from the rest.
+# only the drawn transform runs, whether an earlier one gives the same result is answered by _would_return
+def do_anything(words, rng: Optional[random.Random] = None) -> List[str]:
+  rng = rng or random
   for w in words:
     assert w, words
-  return random.choice(list(do_everything(words)))
+  _note_appearance(words)
+  # when every phrase ends a sentence (and none has one inside), different lists never print the same
+  by_list = all(w.endswith('.') and '. ' not in w for w in words)
+  candidates = list(range(len(_registry)))
+  while True:
+    i = candidates.pop(rng.randrange(len(candidates)))
+    values = _apply(_registry[i], words, rng)
+    # do_nothing comes first, so the loop always ends
+    if any(_same_result(_registry[j], words, values, by_list) for j in range(i)):
+      continue
+    assert not ' '.join(values).startswith('.'), (_registry[i][0].__name__, words, values)
+    return values
+
+
+# randomizes every line of a chapter with one rng, the same as do_anything for each line in turn
+def do_anything_many(lines: Iterable[List[str]], rng: Optional[random.Random] = None) -> List[List[str]]:
+  rng = rng or random
+  return [do_anything(words, rng) for words in lines]
+
+
+def _same_result(transform, words, values, by_list) -> bool:
+  func, takes_rng = transform
+  assert not takes_rng, func.__name__  # only the last transforms are random, they're never an earlier one
+  same = _would_return[func](words, values) if by_list and func in _would_return else None
+  if same is None:
+    same = ' '.join(_apply(transform, words, None)) == ' '.join(values)
+  return same
+
+
+def _sorted_stably(words, values, key) -> bool:
+  # values == sorted(words, key=key): a permutation of words in key order, equal keys in the order of words
+  if len(values) != len(words):
+    return False
+  positions = defaultdict(deque)
+  for i, w in enumerate(words):
+    positions[w].append(i)
+  previous = None
+  for v in values:
+    if not positions.get(v):
+      return False
+    current = key(v), positions[v].popleft()
+    if previous is not None and current < previous:
+      return False
+    previous = current
+  return True
+
+
+def _join_would_return(words, values) -> Optional[bool]:
+  singles = sum(1 for w in words if ' ' not in w)
+  if len(words) == 1 or not singles:
+    return values == words
+  if len(values) != len(words) - singles + 1:
+    return False
+  return None  # the same length, it has to run
 
 
 _appearance_lookup: Dict[str, int] = dict()
 
 
-def sort_global_appearance(words) -> List[str]:
-  terms = []
+# the order words first appeared in is only tracked per chapter, so chapters can be built independently
+def reset_appearance():
+  _appearance_lookup.clear()
+
+
+def _note_appearance(words):
   for w in words:
     k = w.lower()
     if k not in _appearance_lookup:
       _appearance_lookup[k] = len(_appearance_lookup)
-    v = _appearance_lookup[k]
-    terms.append((v, w))
-  terms.sort()
-  return [t[1] for t in terms]
+
+
+def _global_appearance(w):
+  return _appearance_lookup[w.lower()], w
+
+
+def sort_global_appearance(words) -> List[str]:
+  _note_appearance(words)
+  return sorted(words, key=_global_appearance)
+
+
+# built once at import instead of inspecting the module for every line
+_registry = _build_registry()
+
+# transform -> whether it would return values for words (None: it has to run to tell), for the transforms that can
+# come before the drawn one in do_anything
+_would_return: Dict[Callable, Callable[[List[str], List[str]], Optional[bool]]] = {
+  do_nothing: lambda words, values: values == words,
+  join_single_end: _join_would_return,
+  join_single_front: _join_would_return,
+  sort_by_spaces_then_alpha: lambda words, values: _sorted_stably(words, values, _spaces_then_alpha),
+  sort_by_spaces_then_length: lambda words, values: _sorted_stably(words, values, _spaces_then_length),
+  sort_global_appearance: lambda words, values: _sorted_stably(words, values, _global_appearance),
+  sort_reverse: lambda words, values: values == words[::-1],
+}
 
 
 if __name__ == "__main__":
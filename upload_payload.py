@@ -0,0 +1,70 @@
+import hashlib
+import threading
+from typing import NamedTuple, Optional
+
+# full resolution lossless pngs are several MB each, so uploading them is most of an Azure call's latency.
+# frames are scaled down to max_dimension (never up) and re-encoded as jpeg or webp before they're sent.
+# an analysis depends on what was sent, so the profile is part of the analysis store key (see cache_key).
+
+
+class PayloadProfile(NamedTuple):
+  max_dimension: int
+  extension: str  # '.jpg' or '.webp'
+  quality: int  # 0-100 (webp above 100 is lossless)
+
+  @property
+  def name(self) -> str:
+    return '%s%d@q%d' % (self.extension.lstrip('.'), self.max_dimension, self.quality)
+
+
+# the store key of an analysis of file_hash's frame sent with profile, None is the frame as it is
+def cache_key(file_hash: str, profile: Optional[PayloadProfile]) -> str:
+  if profile is None:
+    return file_hash
+  return hashlib.sha256((file_hash + ':' + profile.name).encode('utf-8')).hexdigest()
+
+
+def prepare(data: bytes, profile: Optional[PayloadProfile]) -> bytes:
+  if profile is None:
+    return data
+  import cv2  # only when frames are uploaded
+  import numpy as np
+  quality_flags = {'.jpg': cv2.IMWRITE_JPEG_QUALITY, '.webp': cv2.IMWRITE_WEBP_QUALITY}
+  assert profile.extension in quality_flags, (profile, list(quality_flags))
+  image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+  assert image is not None, 'not an image'
+  height, width = image.shape[:2]
+  scale = profile.max_dimension / max(height, width)
+  if scale < 1:
+    image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                       interpolation=cv2.INTER_AREA)
+  success, encoded = cv2.imencode(profile.extension, image, [quality_flags[profile.extension], profile.quality])
+  assert success, profile
+  payload = encoded.tobytes()
+  if len(payload) >= len(data):
+    payload = data  # already small (e.g. black frames), keep the original
+  stats.add(len(data), len(payload))
+  return payload
+
+
+class PayloadStats:
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.frames = 0
+    self.original_bytes = 0
+    self.sent_bytes = 0
+
+  def add(self, original: int, sent: int):
+    with self._lock:
+      self.frames += 1
+      self.original_bytes += original
+      self.sent_bytes += sent
+
+  def __str__(self):
+    saved = self.original_bytes - self.sent_bytes
+    percent = 100.0 * saved / self.original_bytes if self.original_bytes else 0.0
+    return '%d frames, %.1f MB sent instead of %.1f MB (%.1f MB, %.0f%% saved)' % (
+      self.frames, self.sent_bytes / 1e6, self.original_bytes / 1e6, saved / 1e6, percent)
+
+
+stats = PayloadStats()
@@ -0,0 +1,125 @@
+import itertools
+import threading
+from collections import deque
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, Iterator, NamedTuple, Optional, Tuple, TypeVar
+
+from loguru import logger
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+class TierProfile(NamedTuple):
+  rate: float  # sustained requests per second
+  burst: int  # requests that can be sent back-to-back after being idle
+  window: float = 0  # if set, also at most burst requests in any window seconds (a per-minute quota)
+
+
+tier_profiles: Dict[str, TierProfile] = {
+  # free tier, 20 per minute (plus a second of slack). the window keeps a full bucket plus the rate from letting 40
+  # through in the first minute
+  'F0': TierProfile(rate=20 / 61, burst=20, window=61),
+  'S1': TierProfile(rate=10, burst=10),  # standard tier, 10 TPS
+}
+
+
+# the throttling is adaptive: a 429 pauses every thread for Retry-After seconds and halves the rate,
+# and each success earns back a little of the tier's rate
+class TokenBucket:
+  def __init__(self, profile: TierProfile, callback: Optional[Callable[[float], None]] = None):
+    self.profile = profile
+    self.rate = profile.rate
+    self._tokens = float(profile.burst)
+    self._updated = time.monotonic()
+    self._paused_until = 0.0
+    self._recent = deque(maxlen=profile.burst)  # when the last burst tokens were taken, with a window
+    self._callback = callback
+    self._lock = threading.Lock()
+
+  def try_acquire(self) -> float:
+    # takes a token and returns 0, or returns how long to wait for the next one
+    with self._lock:
+      now = time.monotonic()
+      self._tokens = min(self.profile.burst, self._tokens + (now - self._updated) * self.rate)
+      self._updated = now
+      if now < self._paused_until:
+        return self._paused_until - now
+      if self.profile.window and len(self._recent) == self.profile.burst and now - self._recent[0] < self.profile.window:
+        # at least a millisecond, so the wait can't round away to nothing
+        return max(self._recent[0] + self.profile.window - now, 0.001)
+      # rounding can leave the bucket a hair short of the token it waited for
+      if self._tokens >= 1 - 1e-9:
+        self._tokens = max(0.0, self._tokens - 1)
+        if self.profile.window:
+          self._recent.append(now)
+        return 0
+      return (1 - self._tokens) / self.rate
+
+  def acquire(self):
+    while True:
+      duration = self.try_acquire()
+      if not duration:
+        return
+      if self._callback:
+        self._callback(duration)
+      time.sleep(duration)
+
+  def throttled(self, retry_after: float):
+    with self._lock:
+      self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+      self._tokens = 0
+      self.rate = max(self.profile.rate / 16, self.rate / 2)
+
+  def succeeded(self):
+    with self._lock:
+      self.rate = min(self.profile.rate, self.rate + self.profile.rate / 20)
+
+
+# seconds to wait before retrying a throttled (429) or overloaded (503) request, None for any other error
+def get_retry_after(e: Exception, attempt: int) -> Optional[float]:
+  response = getattr(e, 'response', None)
+  if getattr(response, 'status_code', None) not in (429, 503):
+    return None
+  header = (getattr(response, 'headers', None) or {}).get('Retry-After')
+  try:
+    return float(header)
+  except (TypeError, ValueError):
+    return float(2 ** attempt)
+
+
+def call_with_retries(item: T, call: Callable[[T], R], bucket: TokenBucket, max_attempts: int = 6) -> R:
+  for attempt in itertools.count(1):
+    bucket.acquire()
+    try:
+      result = call(item)
+    except Exception as e:
+      retry_after = get_retry_after(e, attempt)
+      if retry_after is None or attempt >= max_attempts:
+        raise
+      logger.info('throttled on {} (attempt #{}), retrying after {:2.2f} seconds', item, attempt, retry_after)
+      bucket.throttled(retry_after)
+      continue
+    bucket.succeeded()
+    return result
+
+
+# keeps up to `concurrency` calls in flight and yields (item, result) as they complete, which is not input order
+def run_concurrently(items: Iterable[T], call: Callable[[T], R], bucket: TokenBucket,
+                     concurrency: int) -> Iterator[Tuple[T, R]]:
+  remaining = iter(items)
+  with ThreadPoolExecutor(max_workers=concurrency) as pool:
+    in_flight = {}
+
+    def _submit(count):
+      for item in itertools.islice(remaining, count):
+        in_flight[pool.submit(call_with_retries, item, call, bucket)] = item
+
+    _submit(concurrency)
+    while in_flight:
+      done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+      for future in done:
+        item = in_flight.pop(future)
+        yield item, future.result()
+      _submit(len(done))